@@ -49,7 +49,7 @@ def logout(request):
     # Log the logout event (for audit purposes)
     print(f"User logout: {username} ({user_type}) at {datetime.now()}")
     
-    return redirect('homepage')
+    return redirect('home')
 
 
 
@@ -255,7 +255,7 @@ def savepdata(request, patientusername):
                 dob_date = form.cleaned_data['dob']
                 
                 # Update patient profile
-                patient.objects.filter(pk=puser.patient).update(
+                patient.objects.filter(pk=puser.pk).update(
                     name=form.cleaned_data['name'],
                     dob=dob_date,
                     gender=form.cleaned_data['gender'],
@@ -438,7 +438,7 @@ def saveddata(request, doctorusername):
                 yor_date = form.cleaned_data['year_of_registration']
                 
                 # Update doctor profile
-                doctor.objects.filter(pk=duser.doctor).update(
+                doctor.objects.filter(pk=duser.pk).update(
                     name=form.cleaned_data['name'],
                     dob=dob_date,
                     gender=form.cleaned_data['gender'],
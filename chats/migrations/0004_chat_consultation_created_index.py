@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0003_chat_consultation_id_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chat',
+            index=models.Index(fields=['consultation_id', 'created', 'id'], name='chat_consultation_created_idx'),
+        ),
+    ]
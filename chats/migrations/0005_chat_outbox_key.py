@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0004_chat_consultation_created_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='outbox_key',
+            field=models.UUIDField(blank=True, editable=False, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0016_drop_redundant_indexes'),
+        ('chats', '0006_chat_created_default'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='chat',
+            name='consultation_id',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='main_app.consultation'),
+        ),
+    ]
@@ -1,14 +1,28 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import User
 from main_app.models import consultation
 
 # Create your models here.
 
 class Chat(models.Model):
-    created = models.DateTimeField(auto_now_add=True)
-    consultation_id =  models.ForeignKey(consultation, on_delete=models.CASCADE)
+    # Not auto_now_add, so the chat outbox can keep the time a message was sent
+    created = models.DateTimeField(default=timezone.now, editable=False)
+    # No index of its own: both Meta indexes start with it
+    consultation_id =  models.ForeignKey(consultation, on_delete=models.CASCADE, db_index=False)
     sender = models.ForeignKey(User, on_delete=models.CASCADE)
     message = models.TextField()
+    # Set for messages written through the chat outbox; makes replaying a
+    # batch after a crash idempotent
+    outbox_key = models.UUIDField(null=True, blank=True, unique=True, editable=False)
+
+    class Meta:
+        # Incremental fetches read a consultation's messages after a given id
+        # and page through its history by (created, id)
+        indexes = [
+            models.Index(fields=['consultation_id', 'id'], name='chat_consultation_id_idx'),
+            models.Index(fields=['consultation_id', 'created', 'id'], name='chat_consultation_created_idx'),
+        ]
 
     def __unicode__(self):
         return self.message
@@ -0,0 +1,66 @@
+"""
+gunicorn configuration, picked up automatically from the project root.
+
+PRELOAD_MODELS controls when the prediction models are loaded:
+
+    (unset)  lazily, on each worker's first prediction request
+    1        in every worker right after it is forked
+    master   the symptom model once in the master before forking, shared
+             copy-on-write by all workers (implies preload_app); the CNN is
+             still loaded per worker after fork
+
+Use `python manage.py worker_memory` to see the resulting per-worker RSS.
+
+Workers are threaded (GUNICORN_WORKERS processes of GUNICORN_THREADS
+threads) because every open chat page holds a /chat_stream request for up to
+CHAT_STREAM_TIMEOUT seconds. A worker keeps at most half of its threads on
+streams (CHAT_STREAM_MAX_PER_WORKER); further chat pages poll, so posts and
+page loads always find a free thread.
+"""
+import multiprocessing
+import os
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'disease_prediction.settings')
+
+PRELOAD_MODELS = os.environ.get('PRELOAD_MODELS', '')
+
+preload_app = PRELOAD_MODELS == 'master'
+
+worker_class = 'gthread'
+workers = int(os.environ.get('GUNICORN_WORKERS', max(2, multiprocessing.cpu_count())))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+
+def when_ready(server):
+    if PRELOAD_MODELS == 'master':
+        from main_app.model_registry import preload_shared
+        preload_shared()
+
+
+def post_fork(server, worker):
+    # Tells the CNN micro-batcher whether requests can run concurrently
+    os.environ['GUNICORN_THREADS'] = str(worker.cfg.threads)
+
+    # In master mode the symptom model is already inherited from the master,
+    # so this only loads the CNN.
+    if PRELOAD_MODELS in ('1', 'master'):
+        from main_app.model_registry import post_fork as preload_models
+        preload_models(server, worker)
+
+
+def post_worker_init(worker):
+    # The app is loaded by now: pick up image jobs and chat messages left
+    # behind by a restart
+    from django.db import close_old_connections
+    from main_app import chat_outbox
+    from main_app.image_jobs import resume_jobs
+    try:
+        resume_jobs()
+    except Exception as e:
+        print(f"Error resuming image jobs: {str(e)}")
+    finally:
+        close_old_connections()
+    try:
+        chat_outbox.resume()
+    except Exception as e:
+        print(f"Error resuming chat outbox: {str(e)}")
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import patient , doctor , diseaseinfo , consultation,rating_review
+from .models import patient , doctor , diseaseinfo , consultation,rating_review, image_scan_job, disease_daily_stats
 
 # Register your models here.
 
@@ -7,4 +7,6 @@ admin.site.register(patient)
 admin.site.register(doctor)
 admin.site.register(diseaseinfo)
 admin.site.register(consultation)
-admin.site.register(rating_review)
\ No newline at end of file
+admin.site.register(rating_review)
+admin.site.register(image_scan_job)
+admin.site.register(disease_daily_stats)
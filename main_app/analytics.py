@@ -0,0 +1,322 @@
+"""
+Aggregations behind the disease analytics dashboard.
+
+The dashboard never scans diseaseinfo. Every prediction is folded into the
+disease_daily_stats rollup (one row per day, disease and method) as it is
+stored, and the dashboard aggregates that table instead, so its cost grows
+with days x diseases rather than with the number of predictions.
+
+On top of that the computed blocks are kept in the Django cache under a
+version token that is replaced whenever a prediction is committed, so
+between predictions dashboard views do not query the database at all.
+"""
+import datetime
+import hashlib
+import os
+import time
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Trunc, TruncDate
+from django.utils import timezone
+
+from .models import diseaseinfo, disease_daily_stats
+
+
+# Dashboard time ranges: Trunc kind and label format of each bucket
+TIME_RANGES = {
+    'weeks': ('week', 'Week of %d %b %Y'),
+    'months': ('month', '%B %Y'),
+    'years': ('year', '%Y'),
+}
+
+# Seconds a computed dashboard fragment stays cached
+DASHBOARD_CACHE_TIMEOUT = getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', 300)
+
+# Longest time a request waits for another one computing the same fragment
+DASHBOARD_CACHE_LOCK_TIMEOUT = getattr(settings, 'DASHBOARD_CACHE_LOCK_TIMEOUT', 10)
+
+_VERSION_KEY = 'analytics:version'
+_MISSING = object()
+
+
+def _cache_version():
+    version = cache.get(_VERSION_KEY)
+    if version is not None:
+        return version
+
+    # Started under the lock: requests starting versions of their own would
+    # each compute every fragment
+    lock_key = _VERSION_KEY + ':lock'
+    if _acquire_lock(lock_key):
+        try:
+            version = cache.get(_VERSION_KEY)
+            if version is None:
+                version = uuid.uuid4().hex
+                cache.set(_VERSION_KEY, version, None)
+        finally:
+            _release_lock(lock_key)
+        return version
+
+    version = _wait_for(_VERSION_KEY)
+    return uuid.uuid4().hex if version is _MISSING else version
+
+
+def invalidate_dashboard_cache():
+    """Retire every cached fragment by switching to a fresh version token."""
+    cache.set(_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def _lock_file(backend, lock_key):
+    # Not a .djcache file, so the cache's cull() and clear() leave it alone
+    return os.path.join(backend._dir, hashlib.md5(lock_key.encode()).hexdigest() + '.lock')
+
+
+def _acquire_lock(lock_key):
+    """
+    Take the lock of a fragment being computed. Returns: True if taken.
+    cache.add() is atomic on the memcached, Redis, database and local memory
+    backends, but FileBasedCache checks and then writes, so two processes
+    can both win it. On that backend the lock is a file created with O_EXCL
+    next to the cache files instead.
+    """
+    backend = caches[DEFAULT_CACHE_ALIAS]
+    if not isinstance(backend, FileBasedCache):
+        return cache.add(lock_key, 1, DASHBOARD_CACHE_LOCK_TIMEOUT)
+
+    path = _lock_file(backend, lock_key)
+    os.makedirs(backend._dir, exist_ok=True)
+    for _ in range(2):
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            pass
+        try:
+            if time.time() - os.path.getmtime(path) < DASHBOARD_CACHE_LOCK_TIMEOUT:
+                return False
+            # Left behind by a process that died while computing
+            os.remove(path)
+        except FileNotFoundError:
+            pass  # released in the meantime
+    return False
+
+
+def _release_lock(lock_key):
+    backend = caches[DEFAULT_CACHE_ALIAS]
+    if not isinstance(backend, FileBasedCache):
+        cache.delete(lock_key)
+        return
+    try:
+        os.remove(_lock_file(backend, lock_key))
+    except FileNotFoundError:
+        pass
+
+
+def _wait_for(key):
+    """Poll for `key` while another request computes it. Returns: its value, or _MISSING on timeout."""
+    deadline = time.monotonic() + DASHBOARD_CACHE_LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        value = cache.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+    return _MISSING
+
+
+def cached_fragment(name, compute, timeout=DASHBOARD_CACHE_TIMEOUT):
+    """
+    Return the cached value of dashboard fragment `name`, calling `compute`
+    on a miss. Concurrent misses are collapsed: the request that takes the
+    fragment's lock computes the value while the others poll for it, and
+    compute it themselves only if it has not appeared within
+    DASHBOARD_CACHE_LOCK_TIMEOUT seconds.
+    """
+    key = f'analytics:{_cache_version()}:{name}'
+    value = cache.get(key, _MISSING)
+    if value is not _MISSING:
+        return value
+
+    lock_key = key + ':lock'
+    if _acquire_lock(lock_key):
+        try:
+            # Stored by another request between the miss and the lock?
+            value = cache.get(key, _MISSING)
+            if value is _MISSING:
+                value = compute()
+                cache.set(key, value, timeout)
+        finally:
+            _release_lock(lock_key)
+        return value
+
+    value = _wait_for(key)
+    return compute() if value is _MISSING else value
+
+
+def _rollup_key(prediction):
+    day = timezone.localdate(prediction.created_at) if prediction.created_at else None
+    return (day, prediction.diseasename, prediction.prediction_method)
+
+
+def record_predictions(predictions, sign=1):
+    """
+    Add stored diseaseinfo rows to the rollup, or remove them with sign=-1.
+    Called from the diseaseinfo signals and, since bulk_create sends none,
+    directly by views that bulk insert.
+    """
+    deltas = defaultdict(lambda: [0, 0.0])
+    for prediction in predictions:
+        delta = deltas[_rollup_key(prediction)]
+        delta[0] += sign
+        delta[1] += sign * float(prediction.confidence or 0)
+
+    for (day, name, method), (count, confidence_sum) in deltas.items():
+        _upsert(day, name, method, count, confidence_sum)
+
+    if deltas:
+        transaction.on_commit(invalidate_dashboard_cache)
+
+
+def _upsert(day, name, method, count, confidence_sum):
+    rows = disease_daily_stats.objects.filter(date=day, diseasename=name, prediction_method=method)
+    increment = {'count': F('count') + count, 'confidence_sum': F('confidence_sum') + confidence_sum}
+
+    if rows.update(**increment):
+        return
+    try:
+        # Savepoint, so losing the insert race does not break the caller's transaction
+        with transaction.atomic():
+            disease_daily_stats.objects.create(
+                date=day, diseasename=name, prediction_method=method,
+                count=count, confidence_sum=confidence_sum,
+            )
+    except IntegrityError:
+        rows.update(**increment)
+
+
+def rebuild_disease_daily_stats():
+    """
+    Recompute the whole rollup from diseaseinfo with one grouped query.
+    Returns: number of rollup rows written.
+    """
+    rows = (
+        diseaseinfo.objects
+        .annotate(day=TruncDate('created_at'))
+        .values('day', 'diseasename', 'prediction_method')
+        .annotate(n=Count('id'), confidence_total=Sum('confidence'))
+        .order_by()
+    )
+    stats = [
+        disease_daily_stats(
+            date=row['day'],
+            diseasename=row['diseasename'],
+            prediction_method=row['prediction_method'],
+            count=row['n'],
+            confidence_sum=float(row['confidence_total'] or 0),
+        )
+        for row in rows
+    ]
+
+    with transaction.atomic():
+        disease_daily_stats.objects.all().delete()
+        disease_daily_stats.objects.bulk_create(stats, batch_size=500)
+        transaction.on_commit(invalidate_dashboard_cache)
+    return len(stats)
+
+
+def prediction_method_split():
+    """
+    Count all predictions and their split by method in one query.
+    Returns: dict with 'total', 'symptoms' and 'image'.
+    """
+    totals = disease_daily_stats.objects.aggregate(
+        total=Sum('count'),
+        symptoms=Sum('count', filter=Q(prediction_method='symptoms')),
+        image=Sum('count', filter=Q(prediction_method='image')),
+    )
+    return {key: value or 0 for key, value in totals.items()}
+
+
+def disease_statistics(total_predictions):
+    """
+    Per-disease prediction counts, share of all predictions and average
+    confidence from one grouped query, most frequent disease first.
+    Returns: dict of diseasename -> {'count', 'confidence_sum',
+    'percentage', 'avg_confidence'}.
+    """
+    rows = (
+        disease_daily_stats.objects
+        .values('diseasename')
+        .annotate(n=Sum('count'), confidence_total=Sum('confidence_sum'))
+        .filter(n__gt=0)
+        .order_by('-n', 'diseasename')
+    )
+
+    disease_stats = {}
+    for row in rows:
+        confidence_sum = float(row['confidence_total'] or 0)
+        disease_stats[row['diseasename']] = {
+            'count': row['n'],
+            'confidence_sum': confidence_sum,
+            'percentage': (row['n'] / total_predictions * 100) if total_predictions > 0 else 0,
+            'avg_confidence': confidence_sum / row['n'],
+        }
+    return disease_stats
+
+
+def _period_starts(kind, periods, today):
+    """Start dates of the last `periods` buckets of `kind`, oldest first."""
+    if kind == 'week':
+        current = today - datetime.timedelta(days=today.weekday())
+        return [current - datetime.timedelta(weeks=i) for i in range(periods - 1, -1, -1)]
+
+    if kind == 'month':
+        starts = []
+        year, month = today.year, today.month
+        for _ in range(periods):
+            starts.append(datetime.date(year, month, 1))
+            year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+        return starts[::-1]
+
+    return [datetime.date(today.year - i, 1, 1) for i in range(periods - 1, -1, -1)]
+
+
+def prediction_time_series(range_name='months', periods=6):
+    """
+    Number of predictions in each of the last `periods` weeks, months or
+    years, from one Trunc group-by over the daily rollup. Empty buckets are
+    reported as 0; undated predictions are not in any bucket.
+    Returns: list of {'period', 'label', 'count'} dicts, oldest first.
+    """
+    kind, label_format = TIME_RANGES[range_name]
+    today = timezone.localdate()
+    starts = _period_starts(kind, periods, today)
+
+    rows = (
+        disease_daily_stats.objects
+        .filter(date__gte=starts[0])
+        .annotate(period=Trunc('date', kind))
+        .values('period')
+        .annotate(n=Sum('count'))
+        .order_by('period')
+    )
+    counts = {row['period']: row['n'] for row in rows}
+
+    return [
+        {'period': start, 'label': start.strftime(label_format), 'count': counts.get(start, 0)}
+        for start in starts
+    ]
+
+
+def recent_predictions(limit=10):
+    """Returns: the latest `limit` predictions as dicts, newest first."""
+    return list(
+        diseaseinfo.objects
+        .order_by('-id')
+        .values('id', 'diseasename', 'confidence', 'prediction_method')[:limit]
+    )
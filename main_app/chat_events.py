@@ -0,0 +1,217 @@
+"""
+Publish/subscribe for new chat messages.
+
+`post` publishes every stored Chat row on the consultation's channel and the
+chat_stream view pushes it to the open event streams of that consultation,
+so clients no longer poll for the whole history.
+
+The backend is pluggable through CHAT_EVENT_BACKEND (a dotted path to a class
+with the ChatEventBackend interface). The default InProcessBackend only
+reaches streams served by the same process; its `cross_process` flag is
+False, so chat_stream also looks at the consultation's version in the cache
+every CHAT_STREAM_RECHECK seconds and queries the database when another
+gunicorn worker has posted since. A backend
+on a shared broker (Redis pub/sub, PostgreSQL LISTEN/NOTIFY) sets the flag
+and streams then never query for new messages.
+
+The module also keeps a (last message id, message count) pair per
+consultation in the Django cache. chat_messages uses it as its ETag, so an
+idle conversation is answered with 304 Not Modified from the cache alone.
+Posts never write the pair: each one bumps the consultation's version with
+cache.incr, and a pair is only trusted under the version it was counted at,
+so concurrent posts and reads cannot leave a stale pair behind. incr is
+atomic on Redis, Memcached and the local-memory cache; the file cache
+implements it as get and set.
+"""
+import queue
+import random
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.utils.module_loading import import_string
+
+
+CHAT_EVENT_BACKEND = getattr(settings, 'CHAT_EVENT_BACKEND', 'main_app.chat_events.InProcessBackend')
+
+# Seconds a counted chat state is kept for its version
+CHAT_STATE_TIMEOUT = getattr(settings, 'CHAT_STATE_TIMEOUT', 60)
+
+# Events buffered per subscriber before the oldest are dropped (a stream that
+# falls this far behind catches up from the database)
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class ChatEventBackend:
+    """Interface of a chat event backend."""
+
+    # True when subscribers receive events published by every process
+    cross_process = False
+
+    def publish(self, channel, event):
+        raise NotImplementedError
+
+    def subscribe(self, channel):
+        """Returns: a subscription with get(timeout) -> list of events, and close()."""
+        raise NotImplementedError
+
+
+class _Subscription:
+
+    def __init__(self, backend, channel):
+        self._backend = backend
+        self.channel = channel
+        self._queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            pass
+
+    def get(self, timeout=None):
+        """Wait up to `timeout` seconds for events. Returns: every queued event, oldest first."""
+        try:
+            events = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                events.append(self._queue.get_nowait())
+            except queue.Empty:
+                return events
+
+    def close(self):
+        self._backend._unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class InProcessBackend(ChatEventBackend):
+    """Fans events out to the subscribers living in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def publish(self, channel, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.put(event)
+
+    def subscribe(self, channel):
+        subscription = _Subscription(self, channel)
+        with self._lock:
+            self._subscribers[channel].add(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Return the process-wide CHAT_EVENT_BACKEND instance."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = import_string(CHAT_EVENT_BACKEND)()
+    return _backend
+
+
+def channel_for(consultation_id):
+    return f'consultation:{consultation_id}'
+
+
+def chat_event(chat):
+    """Returns: the JSON-serialisable event describing Chat row `chat`."""
+    return {
+        'id': chat.id,
+        'sender': chat.sender.username,
+        'message': chat.message,
+        'created': chat.created.isoformat(),
+        # Lets the sender match the message it was acknowledged by the outbox
+        'key': str(chat.outbox_key) if chat.outbox_key else None,
+    }
+
+
+def publish_chat(chat):
+    get_backend().publish(channel_for(chat.consultation_id_id), chat_event(chat))
+
+
+def _version_key(consultation_id):
+    return f'chat:version:{consultation_id}'
+
+
+def _state_key(consultation_id, version):
+    return f'chat:state:{consultation_id}:{version}'
+
+
+def _count_chat_state(consultation_id):
+    from chats.models import Chat
+
+    totals = Chat.objects.filter(consultation_id=consultation_id).aggregate(last_id=Max('id'), count=Count('id'))
+    return (totals['last_id'] or 0, totals['count'])
+
+
+def _chat_version(consultation_id):
+    key = _version_key(consultation_id)
+    version = cache.get(key)
+    if version is None:
+        # A random start, so a version lost to eviction never brings back
+        # the states cached under its old numbers
+        cache.add(key, random.getrandbits(48), None)
+        version = cache.get(key)
+    return version
+
+
+def chat_version(consultation_id):
+    """
+    Returns: the consultation's current version, bumped by every post in any
+    process that shares the cache; None when it has none (yet) in the cache.
+    """
+    return cache.get(_version_key(consultation_id))
+
+
+def chat_state(consultation_id):
+    """Returns: (last message id, message count) of the consultation, from the cache when possible."""
+    # The version is read before counting: a post committed after the count
+    # bumps it, so this state is never served once it is out of date
+    version = _chat_version(consultation_id)
+    if version is None:
+        return _count_chat_state(consultation_id)
+    state = cache.get(_state_key(consultation_id, version))
+    if state is None:
+        state = _count_chat_state(consultation_id)
+        cache.set(_state_key(consultation_id, version), state, CHAT_STATE_TIMEOUT)
+    return state
+
+
+def chat_posted(chat):
+    """Invalidate the consultation's chat state and notify its streams. Call once `chat` is committed."""
+    try:
+        cache.incr(_version_key(chat.consultation_id_id))
+    except ValueError:
+        pass  # no version yet; the next read starts one
+
+    publish_chat(chat)
+
+
+def subscribe_consultation(consultation_id):
+    return get_backend().subscribe(channel_for(consultation_id))
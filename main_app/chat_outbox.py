@@ -0,0 +1,199 @@
+"""
+Durable outbox for chat messages.
+
+`post` does not insert Chat rows itself. It appends the message to a local
+SQLite outbox in WAL mode and acknowledges it as soon as that append is
+committed. A flusher thread in each process moves the outbox into the main
+database in batches with a single bulk_create. Concurrent senders then cost
+one cheap append each instead of one write transaction each on the main
+database, which under SQLite all serialize on its single write lock.
+
+Ordering: the outbox seq is global and FIFO, and a flush inserts its batch
+in seq order, so messages keep the order they were acknowledged in, within
+each consultation as well. Each row records when it was enqueued and that
+time becomes Chat.created, so a flush delay never shows up in the history.
+A flush holds the outbox write lock (BEGIN IMMEDIATE), so the flushers of
+different gunicorn workers never move the same rows. Every row carries an
+outbox_key that is unique on Chat, so a batch replayed after a crash between
+the two commits is not inserted twice. Messages left behind by a previous
+process are drained by resume(), which gunicorn.conf.py calls in every new
+worker.
+"""
+import datetime
+import os
+import sqlite3
+import threading
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .chat_events import chat_posted
+from .models import consultation
+
+
+CHAT_OUTBOX_PATH = getattr(settings, 'CHAT_OUTBOX_PATH', os.path.join(settings.BASE_DIR, 'data', 'chat_outbox.sqlite3'))
+
+# Largest number of messages moved to the main database by one bulk_create
+CHAT_OUTBOX_BATCH_SIZE = getattr(settings, 'CHAT_OUTBOX_BATCH_SIZE', 200)
+
+# Seconds the flusher sleeps when nothing wakes it up
+CHAT_OUTBOX_FLUSH_INTERVAL = getattr(settings, 'CHAT_OUTBOX_FLUSH_INTERVAL', 1.0)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS chat_outbox (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL,
+    consultation_id INTEGER NOT NULL,
+    sender_id INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    created TEXT
+)
+'''
+
+_local = threading.local()
+
+
+def _connect():
+    # One connection per thread, and never one inherited across fork()
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid() or _local.path != CHAT_OUTBOX_PATH:
+        os.makedirs(os.path.dirname(CHAT_OUTBOX_PATH), exist_ok=True)
+        conn = sqlite3.connect(CHAT_OUTBOX_PATH, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=FULL')
+        conn.execute(_SCHEMA)
+        # Outboxes written before the created column existed
+        if 'created' not in {row[1] for row in conn.execute('PRAGMA table_info(chat_outbox)')}:
+            conn.execute('ALTER TABLE chat_outbox ADD COLUMN created TEXT')
+        _local.conn = conn
+        _local.pid = os.getpid()
+        _local.path = CHAT_OUTBOX_PATH
+    return conn
+
+
+def enqueue(consultation_id, sender_id, message):
+    """Durably append a message to the outbox. Returns: its outbox key (a str UUID)."""
+    key = str(uuid.uuid4())
+    _connect().execute(
+        'INSERT INTO chat_outbox (key, consultation_id, sender_id, message, created) VALUES (?, ?, ?, ?, ?)',
+        (key, consultation_id, sender_id, message, timezone.now().isoformat()),
+    )
+    get_flusher().wake()
+    return key
+
+
+def pending():
+    """Returns: number of messages waiting in the outbox."""
+    return _connect().execute('SELECT COUNT(*) FROM chat_outbox').fetchone()[0]
+
+
+def flush(limit=CHAT_OUTBOX_BATCH_SIZE):
+    """
+    Move up to `limit` of the oldest outbox messages into Chat, then publish
+    them. Messages whose consultation or sender no longer exists are dropped.
+    Returns: number of outbox rows consumed.
+    """
+    from chats.models import Chat
+
+    conn = _connect()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        rows = conn.execute(
+            'SELECT seq, key, consultation_id, sender_id, message, created FROM chat_outbox ORDER BY seq LIMIT ?',
+            (limit,),
+        ).fetchall()
+        if not rows:
+            conn.execute('ROLLBACK')
+            return 0
+
+        consultation_ids = set(consultation.objects.filter(id__in={r[2] for r in rows}).values_list('id', flat=True))
+        sender_ids = set(User.objects.filter(id__in={r[3] for r in rows}).values_list('id', flat=True))
+        now = timezone.now()
+        chats = [
+            Chat(
+                outbox_key=key, consultation_id_id=consultation_id, sender_id=sender_id, message=message,
+                created=datetime.datetime.fromisoformat(created) if created else now,
+            )
+            for _, key, consultation_id, sender_id, message, created in rows
+            if consultation_id in consultation_ids and sender_id in sender_ids
+        ]
+        if len(chats) < len(rows):
+            print(f"Chat outbox: dropped {len(rows) - len(chats)} messages of deleted consultations or users")
+
+        with transaction.atomic():
+            Chat.objects.bulk_create(chats, ignore_conflicts=True)
+        conn.execute('DELETE FROM chat_outbox WHERE seq <= ?', (rows[-1][0],))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+    # bulk_create with ignore_conflicts does not set primary keys, so read
+    # the rows back to publish them with their ids
+    saved = Chat.objects.filter(outbox_key__in=[c.outbox_key for c in chats]).select_related('sender').order_by('id')
+    for chat in saved:
+        chat_posted(chat)
+    return len(rows)
+
+
+def flush_all():
+    """Flush until the outbox is empty. Returns: number of outbox rows consumed."""
+    total = 0
+    while True:
+        moved = flush()
+        if not moved:
+            return total
+        total += moved
+
+
+def resume():
+    """Start draining messages left in the outbox by a previous process. Call at worker start."""
+    if pending():
+        get_flusher().wake()
+
+
+class OutboxFlusher:
+    """Background thread that drains the outbox whenever a message is enqueued."""
+
+    def __init__(self, interval=CHAT_OUTBOX_FLUSH_INTERVAL):
+        self.interval = interval
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._pid = None
+
+    def wake(self):
+        self._ensure_worker()
+        self._wake.set()
+
+    def _ensure_worker(self):
+        # Threads do not survive fork(), see MicroBatcher._ensure_worker
+        if self._worker is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker is None or self._pid != os.getpid():
+                self._wake = threading.Event()
+                self._pid = os.getpid()
+                self._worker = threading.Thread(target=self._run, name='chat-outbox-flusher', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                flush_all()
+            except Exception as e:
+                print(f"Error flushing chat outbox: {str(e)}")
+            finally:
+                close_old_connections()
+
+
+_flusher = OutboxFlusher()
+
+
+def get_flusher():
+    return _flusher
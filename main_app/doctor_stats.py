@@ -0,0 +1,65 @@
+"""
+Counters shown on the doctor dashboard.
+
+All consultation counters come from one conditional-aggregate query and are
+cached per doctor for DOCTOR_STATS_TIMEOUT seconds; a consultation being
+created, closed or deleted drops that doctor's entry. Rating figures are read
+from the doctor row's running totals (see ratings.py), so they need neither a
+query nor a cache.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from .models import consultation
+
+
+# Seconds a doctor's consultation counters are served from the cache
+DOCTOR_STATS_TIMEOUT = getattr(settings, 'DOCTOR_STATS_TIMEOUT', 30)
+
+
+def _cache_key(doctor_id):
+    return f'doctor_stats:{doctor_id}'
+
+
+def consultation_counts(doctor_id):
+    """Returns: dict with 'total', 'active' and 'closed' consultation counts of the doctor."""
+    counts = cache.get(_cache_key(doctor_id))
+    if counts is None:
+        counts = consultation.objects.filter(doctor_id=doctor_id).aggregate(
+            total=Count('id'),
+            active=Count('id', filter=Q(status='active')),
+            closed=Count('id', filter=Q(status='closed')),
+        )
+        cache.set(_cache_key(doctor_id), counts, DOCTOR_STATS_TIMEOUT)
+    return counts
+
+
+def invalidate_doctor_stats(doctor_id):
+    if doctor_id is not None:
+        cache.delete(_cache_key(doctor_id))
+
+
+def doctor_stats(doctor_obj):
+    """
+    Everything the doctor dashboard shows about `doctor_obj`.
+    Returns: dict with 'total_consultations', 'active_consultations',
+    'completed_consultations', 'total_reviews', 'doctor_rating' and
+    'performance_score'.
+    """
+    counts = consultation_counts(doctor_obj.pk)
+    doctor_rating = doctor_obj.average_rating
+
+    # Calculate performance score based on consultations and rating
+    performance_score = min(5, max(1, (counts['total'] // 5) + int(doctor_rating)))
+    if counts['total'] == 0:
+        performance_score = 3  # Default score for new doctors
+
+    return {
+        'total_consultations': counts['total'],
+        'active_consultations': counts['active'],
+        'completed_consultations': counts['closed'],
+        'total_reviews': doctor_obj.rating_count,
+        'doctor_rating': doctor_rating,
+        'performance_score': performance_score,
+    }
@@ -0,0 +1,85 @@
+"""
+In-process micro-batching for the CNN image model.
+
+Keras `predict` has a large fixed cost per call, so running one forward pass
+per upload wastes most of the CPU on overhead. MicroBatcher lets concurrent
+requests hand in single images; a background thread waits up to `max_wait`
+seconds for more to arrive, runs one forward pass over the whole batch and
+fans the rows of the result back out to the waiting requests.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class MicroBatcher:
+
+    def __init__(self, predict, max_batch_size=16, max_wait=0.005):
+        """
+        predict: callable taking an (n, ...) array and returning n result rows
+        max_batch_size: largest batch handed to `predict`
+        max_wait: seconds to wait for more requests after the first one arrives
+        """
+        self._predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._pid = None
+
+    def submit(self, item):
+        """Queue one input for the next batch. Returns: a Future of its result row."""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def predict(self, item, timeout=None):
+        """Run `item` through the model as part of a batch and wait for its result."""
+        return self.submit(item).result(timeout)
+
+    def _ensure_worker(self):
+        # Threads do not survive fork(), so a batcher created in the gunicorn
+        # master starts its own worker thread in every child on first use.
+        if self._worker is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker is None or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._worker = threading.Thread(target=self._run, name='image-micro-batcher', daemon=True)
+                self._worker.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            futures = [future for _, future in batch]
+            try:
+                results = self._predict(np.stack([item for item, _ in batch]))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, result in zip(futures, results):
+                future.set_result(result)
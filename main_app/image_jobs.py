@@ -0,0 +1,145 @@
+"""
+Asynchronous skin image prediction jobs.
+
+An upload in async mode is stored as an image_scan_job row and answered with
+the job id straight away; decoding, validation, CNN inference and the
+diseaseinfo insert then run outside the request. The image_scan_job table is
+the queue: by default a small in-process thread pool picks jobs up as soon as
+they are committed. With IMAGE_JOB_WORKERS = 0 jobs stay queued until a
+separate `manage.py run_image_jobs` process claims them.
+
+Uploads are checked from their header (one of UPLOAD_FORMATS, pixel count)
+before they are stored, and the stored file of a failed job is deleted. Jobs interrupted
+by a restart are picked up again by resume_jobs(), which gunicorn.conf.py
+calls in every new worker; `run_image_jobs` does the same when it starts.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .imaging import UPLOAD_FORMATS, ImageIngestError, SkinImageRejected, classify_skin_image, open_upload
+from .models import diseaseinfo, image_scan_job
+
+
+IMAGE_JOB_WORKERS = getattr(settings, 'IMAGE_JOB_WORKERS', 2)
+MAX_UPLOAD_PIXELS = getattr(settings, 'MAX_UPLOAD_PIXELS', 40000000)
+
+# Seconds after a job was claimed after which, still marked running, it is
+# taken to have died with its worker and is queued again; far above the time
+# one prediction takes
+IMAGE_JOB_STALE_AFTER = getattr(settings, 'IMAGE_JOB_STALE_AFTER', 600)
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    # Thread pools do not survive fork(), so every worker builds its own
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=IMAGE_JOB_WORKERS, thread_name_prefix='image-job')
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def submit_scan_job(patient_obj, uploaded_image):
+    """
+    Store the upload as a queued job and hand it to the local pool once committed.
+    Raises: ImageIngestError, before anything is stored, for an upload that
+    is not an image of a supported format or has too many pixels
+    """
+    open_upload(uploaded_image, MAX_UPLOAD_PIXELS, formats=UPLOAD_FORMATS)
+    uploaded_image.seek(0)
+
+    job = image_scan_job(patient=patient_obj, skin_image=uploaded_image)
+    job.save()
+
+    if IMAGE_JOB_WORKERS > 0:
+        transaction.on_commit(lambda: _get_executor().submit(_run_in_thread, job.pk))
+    return job
+
+
+def requeue_stale_jobs():
+    """Queue again the jobs left running by a dead worker. Returns: how many."""
+    cutoff = timezone.now() - timedelta(seconds=IMAGE_JOB_STALE_AFTER)
+    # Time spent queued does not count: a job is stale once it has been
+    # running that long. Jobs claimed before `started` existed have none.
+    return image_scan_job.objects.filter(
+        Q(started__lt=cutoff) | Q(started__isnull=True, created__lt=cutoff), status='running',
+    ).update(status='queued', started=None)
+
+
+def resume_jobs():
+    """Requeue stale jobs and hand every queued job to the local pool. Call at worker start."""
+    requeue_stale_jobs()
+    if IMAGE_JOB_WORKERS > 0:
+        # Every worker may submit the same job; run_scan_job claims it once
+        for job_id in image_scan_job.objects.filter(status='queued').order_by('created').values_list('id', flat=True):
+            _get_executor().submit(_run_in_thread, job_id)
+
+
+def _run_in_thread(job_id):
+    close_old_connections()
+    try:
+        run_scan_job(job_id)
+    finally:
+        close_old_connections()
+
+
+def claim_next_job():
+    """Atomically move the oldest queued job to running. Returns: its id or None."""
+    for job_id in image_scan_job.objects.filter(status='queued').order_by('created').values_list('id', flat=True)[:10]:
+        if image_scan_job.objects.filter(pk=job_id, status='queued').update(status='running', started=timezone.now()):
+            return job_id
+    return None
+
+
+def run_scan_job(job_id, claimed=False):
+    """Run one job: classify its image and store the resulting diseaseinfo."""
+    if not claimed and not image_scan_job.objects.filter(pk=job_id, status='queued').update(
+            status='running', started=timezone.now()):
+        return  # already taken by another worker
+
+    job = image_scan_job.objects.select_related('patient').get(pk=job_id)
+    try:
+        with job.skin_image.open('rb') as f:
+            result = classify_skin_image(f, max_pixels=MAX_UPLOAD_PIXELS)
+    except SkinImageRejected as e:
+        job.status = 'failed'
+        job.error = ('Please upload a clear image of skin disease/lesion. ' + e.reason)[:500]
+    except ImageIngestError as e:
+        job.status = 'failed'
+        job.error = str(e)[:500]
+    except Exception as e:
+        print(f"Error in image scan job {job_id}: {str(e)}")
+        job.status = 'failed'
+        job.error = f'Prediction failed: {str(e)}'[:500]
+    else:
+        with transaction.atomic():
+            job.diseaseinfo = diseaseinfo.objects.create(
+                patient=job.patient,
+                diseasename=result['predicteddisease'],
+                no_of_symp=0,  # No symptoms for image-based
+                symptomsname=[],
+                confidence=result['confidence'],
+                consultdoctor=result['consultdoctor'],
+                skin_image=job.skin_image.name,  # reuse the stored upload
+                prediction_method='image'
+            )
+            job.status = 'done'
+            job.finished = timezone.now()
+            job.save()
+        return
+
+    # Nothing refers to the upload of a failed job
+    job.skin_image.delete(save=False)
+    job.finished = timezone.now()
+    job.save()
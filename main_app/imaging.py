@@ -0,0 +1,284 @@
+"""
+Image helpers for the skin image scanner.
+"""
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image
+
+
+# Side of the square thumbnail the skin validation statistics are computed on
+VALIDATION_SIZE = 64
+
+# Side of the square input the CNN image model expects
+INFERENCE_SIZE = 224
+
+# Uploads with more pixels than this are rejected before they are decoded
+MAX_UPLOAD_PIXELS = 40000000
+
+# Formats accepted for uploads that are stored and scanned later, as reported
+# by PIL (MPO is how PIL reports the multi-picture JPEGs many phone cameras
+# write). Uploads scanned in the request are not restricted: any format PIL
+# decodes is accepted there, as it always has been.
+UPLOAD_FORMATS = ('JPEG', 'MPO', 'PNG', 'WEBP')
+
+
+class ImageIngestError(ValueError):
+    """An upload that cannot be decoded or is too large to decode."""
+
+
+class SkinImageRejected(ImageIngestError):
+    """An upload that decodes fine but does not look like a skin disease photo."""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+# size is the original (width, height); image is the decoded, possibly
+# draft-reduced RGB image; inference and thumbnail are RGB uint8 arrays of
+# INFERENCE_SIZE and VALIDATION_SIZE squares.
+IngestedImage = namedtuple('IngestedImage', ['size', 'image', 'inference', 'thumbnail'])
+
+
+def open_upload(fileobj, max_pixels=MAX_UPLOAD_PIXELS, formats=None):
+    """
+    Open an upload and check its pixel count, and its format when `formats`
+    is given, from the header alone; no pixel data is decoded.
+    Returns: the lazily loaded PIL image
+    Raises: ImageIngestError
+    """
+    try:
+        img = Image.open(fileobj)
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        raise ImageIngestError('Invalid image file')
+    if formats is not None and img.format not in formats:
+        raise ImageIngestError('Unsupported image format. Please upload a JPG or PNG image.')
+    if img.size[0] * img.size[1] > max_pixels:
+        raise ImageIngestError('Image is too large. Please resize to a smaller size.')
+    return img
+
+
+def ingest_image(fileobj, max_pixels=MAX_UPLOAD_PIXELS):
+    """
+    Decode an uploaded image once and derive every array the scanner needs.
+
+    JPEGs are decoded with draft() so libjpeg downscales them by up to 8x in
+    the DCT domain, never below INFERENCE_SIZE. The pixel count is checked
+    from the header before any pixel data is decoded.
+    """
+    img = open_upload(fileobj, max_pixels)
+    size = img.size
+    try:
+        img.draft('RGB', (INFERENCE_SIZE, INFERENCE_SIZE))
+        img = img.convert('RGB')
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        raise ImageIngestError('Invalid image file')
+
+    inference = img.resize((INFERENCE_SIZE, INFERENCE_SIZE))
+    thumbnail = inference.resize((VALIDATION_SIZE, VALIDATION_SIZE))
+    return IngestedImage(size, img, np.asarray(inference), np.asarray(thumbnail))
+
+
+def validation_thumbnail(img):
+    """Return the RGB uint8 VALIDATION_SIZE x VALIDATION_SIZE array validate_skin_image analyses."""
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    return np.asarray(img.resize((VALIDATION_SIZE, VALIDATION_SIZE)))
+
+
+def skin_image_metrics(thumbnail):
+    """
+    Compute the colour statistics of an RGB uint8 thumbnail in one vectorized pass.
+    Returns: dict with 'skin_percentage', 'avg_brightness', 'brightness_std'
+    and 'color_variance'.
+    """
+    # A single float32 conversion; uint8 arithmetic would wrap around
+    pixels = np.asarray(thumbnail, dtype=np.float32)
+    r, g, b = pixels[..., 0], pixels[..., 1], pixels[..., 2]
+
+    # Skin color detection (RGB ranges for human skin)
+    skin_mask = (r > 95) & (g > 40) & (b > 20) & \
+                (np.ptp(pixels, axis=2) > 15) & \
+                (np.abs(r - g) > 15) & (r > g) & (r > b)
+
+    # Accumulated in float64: E[x^2] - mean^2 in float32 drifts enough to
+    # move images across the variance thresholds
+    mean = float(pixels.mean(dtype=np.float64))
+    variance = float(pixels.var(dtype=np.float64))
+
+    return {
+        'skin_percentage': float(np.count_nonzero(skin_mask)) / skin_mask.size,
+        'avg_brightness': mean,
+        'brightness_std': variance ** 0.5,
+        'color_variance': variance,
+    }
+
+
+def validate_skin_image(img, thumbnail=None, size=None):
+    """
+    Validate if the uploaded image is likely to be a skin disease image.
+    `thumbnail` may pass in an already computed validation_thumbnail(img) and
+    `size` the original (width, height) when `img` was reduced while decoding.
+    Returns: dict with 'is_skin_image' (bool), 'reason' (str) and 'metrics' (dict)
+    """
+    try:
+        if thumbnail is None:
+            thumbnail = validation_thumbnail(img)
+
+        metrics = skin_image_metrics(thumbnail)
+
+        # Image dimension validation
+        width, height = size or img.size
+        aspect_ratio = width / height
+        metrics.update(width=width, height=height, aspect_ratio=aspect_ratio)
+
+        skin_percentage = metrics['skin_percentage']
+        avg_brightness = metrics['avg_brightness']
+        brightness_std = metrics['brightness_std']
+        color_variance = metrics['color_variance']
+
+        # Validation checks
+        issues = []
+
+        # Check 1: Image too small
+        if width < 100 or height < 100:
+            issues.append("Image is too small. Please upload a clearer, higher resolution image.")
+
+        # Check 2: Image too large
+        if width > 4000 or height > 4000:
+            issues.append("Image is too large. Please resize to a smaller size.")
+
+        # Check 3: Extremely skewed aspect ratio (likely not a skin photo)
+        if aspect_ratio > 4 or aspect_ratio < 0.25:
+            issues.append("Image aspect ratio suggests this may not be a skin disease photo.")
+
+        # Check 4: Very low skin color percentage (likely not skin)
+        if skin_percentage < 0.1:  # Less than 10% skin-like colors
+            issues.append("Image does not appear to contain human skin. Please upload a skin disease image.")
+
+        # Check 5: Very bright or very dark images (likely not medical photos)
+        if avg_brightness < 30:
+            issues.append("Image is too dark. Please ensure good lighting.")
+        elif avg_brightness > 240:
+            issues.append("Image is too bright/overexposed. Please ensure proper lighting.")
+
+        # Check 6: Very low color variance (likely solid color or very uniform)
+        if color_variance < 100:
+            issues.append("Image appears too uniform. Please upload a clearer photo with visible skin texture.")
+
+        # Check 7: Very high color variance (likely noisy or non-skin image)
+        if color_variance > 5000:
+            issues.append("Image appears to have excessive noise or may not be a medical photo.")
+
+        # Check 8: Check for face-like features (basic heuristic)
+        # This is a simple check - faces typically have more defined patterns
+        if brightness_std > 80 and skin_percentage > 0.3:
+            issues.append("This image may contain a face. Please upload only skin disease/lesion photos.")
+
+        if issues:
+            return {
+                'is_skin_image': False,
+                'reason': ' '.join(issues),
+                'metrics': metrics
+            }
+
+        # Additional validation for medical suitability
+        # Check if image has enough detail for medical analysis
+        if skin_percentage < 0.3:
+            return {
+                'is_skin_image': False,
+                'reason': "Image doesn't contain enough visible skin area for medical analysis.",
+                'metrics': metrics
+            }
+
+        # If all checks pass, it's likely a valid skin image
+        return {
+            'is_skin_image': True,
+            'reason': 'Valid skin disease image',
+            'metrics': metrics
+        }
+
+    except Exception as e:
+        # If analysis fails, return as potentially valid but log the error
+        print(f"Image validation error: {str(e)}")
+        return {
+            'is_skin_image': True,
+            'reason': 'Validation completed with warnings',
+            'metrics': {}
+        }
+
+
+def basic_skin_prediction(img_array):
+    """
+    Colour heuristic used when no CNN image model is available.
+    Returns: (predicted_disease, confidence)
+    """
+    try:
+        avg_color = np.mean(img_array, axis=(0, 1)) / 255.0
+        red_ratio = float(avg_color[0]) / float(avg_color[1] + avg_color[2] + 1e-6)
+        blue_ratio = float(avg_color[2]) / float(avg_color[0] + avg_color[1] + 1e-6)
+
+        brightness = np.mean(img_array)
+
+        if red_ratio > 1.5:
+            if brightness < 100:
+                return "Skin Lesion - Possible Infection", 75.2
+            return "Erythema (Red Skin)", 68.4
+        elif blue_ratio > 1.2:
+            return "Cyanosis or Blue Discoloration", 71.8
+        elif brightness < 80:
+            return "Melanocytic Lesion", 72.6
+        elif brightness > 180:
+            return "Hypopigmented Lesion", 69.1
+        elif np.std(img_array) > 30:
+            return "Multicolored Skin Condition", 74.3
+        return "Benign Skin Condition", 67.8
+
+    except Exception as e:
+        print(f"Error in basic image analysis: {str(e)}")
+        return "Skin Condition - Requires Expert Review", 65.0
+
+
+def classify_skin_image(fileobj, max_pixels=MAX_UPLOAD_PIXELS, timeout=None):
+    """
+    Decode, validate and classify an uploaded skin image.
+    Runs the CNN (through the micro-batcher on threaded workers) when a model
+    is available and the colour heuristic otherwise.
+    Returns: dict with 'predicteddisease', 'confidence' and 'consultdoctor'
+    Raises: ImageIngestError, or SkinImageRejected when validation fails
+    """
+    from .model_registry import get_image_batcher, get_image_model
+
+    # Decode once: both the validation thumbnail and the CNN input come from
+    # the same (draft-reduced) image
+    ingested = ingest_image(fileobj, max_pixels=max_pixels)
+
+    # Validate that this is a skin disease image
+    skin_validation = validate_skin_image(ingested.image, ingested.thumbnail, ingested.size)
+    if not skin_validation['is_skin_image']:
+        raise SkinImageRejected(skin_validation['reason'])
+
+    img_array = ingested.inference
+
+    # Run CNN model if available, else fallback to basic image analysis
+    image_model, image_labels = get_image_model()
+    if image_model and image_labels:
+        # Concurrent uploads share one forward pass through the batcher
+        batcher = get_image_batcher()
+        if batcher is not None:
+            preds = batcher.predict(img_array / 255.0, timeout=timeout)
+        else:
+            preds = image_model.predict((img_array / 255.0)[np.newaxis], verbose=0)[0]
+        idx = int(np.argmax(preds))
+        predicted_disease = image_labels[idx] if idx < len(image_labels) else "Skin Condition"
+        confidence = float(np.max(preds)) * 100
+    else:
+        predicted_disease, confidence = basic_skin_prediction(img_array)
+
+    return {
+        'predicteddisease': predicted_disease,
+        'confidence': confidence,
+        # Every image prediction is referred to a dermatologist
+        'consultdoctor': "Dermatologist",
+    }
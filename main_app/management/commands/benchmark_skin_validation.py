@@ -0,0 +1,75 @@
+"""
+Django management command to measure the per-image cost of skin image validation
+Usage: python manage.py benchmark_skin_validation [--image PATH] [--iterations N]
+"""
+import io
+import time
+
+import numpy as np
+from PIL import Image
+from django.core.management.base import BaseCommand, CommandError
+
+from main_app.imaging import ingest_image, skin_image_metrics, validate_skin_image, validation_thumbnail
+
+
+def _synthetic_photo(width=1600, height=1200):
+    """A noisy skin-toned RGB photo, used when no --image is given."""
+    rng = np.random.default_rng(0)
+    base = np.array([200, 140, 110], dtype=np.float32)
+    pixels = base + rng.normal(0, 25, size=(height, width, 3))
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks image ingest, validate_skin_image and its thumbnail and statistics steps'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--image',
+            type=str,
+            help='Image file to validate (default: a synthetic 1600x1200 photo)'
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=200,
+            help='Number of timed runs per step (default: 200)'
+        )
+
+    def _time(self, label, func, iterations):
+        func()  # warm up
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        per_image = (time.perf_counter() - start) / iterations
+        self.stdout.write(f'{label:<28} {per_image * 1000:>8.3f} ms/image')
+
+    def handle(self, *args, **options):
+        if options['image']:
+            try:
+                with open(options['image'], 'rb') as f:
+                    data = f.read()
+                img = Image.open(io.BytesIO(data))
+                img.load()
+            except OSError as e:
+                raise CommandError(f'Could not open image: {e}')
+        else:
+            img = _synthetic_photo()
+            buffer = io.BytesIO()
+            img.save(buffer, 'JPEG', quality=90)
+            data = buffer.getvalue()
+
+        iterations = options['iterations']
+        thumbnail = validation_thumbnail(img)
+
+        self.stdout.write(self.style.SUCCESS(f'{img.size[0]}x{img.size[1]} {img.mode} image, {iterations} iterations'))
+        self._time('ingest (decode + resize)', lambda: ingest_image(io.BytesIO(data)), iterations)
+        self._time('thumbnail', lambda: validation_thumbnail(img), iterations)
+        self._time('metrics', lambda: skin_image_metrics(thumbnail), iterations)
+        self._time('validate (given thumbnail)', lambda: validate_skin_image(img, thumbnail), iterations)
+        self._time('validate (full)', lambda: validate_skin_image(img), iterations)
+
+        result = validate_skin_image(img, thumbnail)
+        self.stdout.write(f'Result: {result["is_skin_image"]} - {result["reason"]}')
+        for name, value in result['metrics'].items():
+            self.stdout.write(f'  {name}: {value:.3f}' if isinstance(value, float) else f'  {name}: {value}')
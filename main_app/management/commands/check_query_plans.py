@@ -0,0 +1,108 @@
+"""
+Django management command to verify that the hot queries use indexes
+Usage: python manage.py check_query_plans [--database default] [--verbose]
+
+Runs EXPLAIN on every query listed in hot_queries() and fails if any plan
+reads a whole table: a "SCAN <table>" step without an index on SQLite, a
+"Seq Scan" node on PostgreSQL. On PostgreSQL sequential scans are disabled
+for the check, so a small development table does not make the planner
+prefer one; a Seq Scan that remains means there is no usable index.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.models import Count, Q
+from django.db.models.functions import Lower
+
+from chats.models import Chat
+from main_app.models import consultation, diseaseinfo, doctor, rating_review
+
+
+def hot_queries(using):
+    """Returns: (label, queryset) pairs mirroring the filters the views run on large tables."""
+    # Plans do not depend on the values, only on the filtered columns
+    return [
+        ('patient disease checks',
+         diseaseinfo.objects.using(using).filter(patient_id=1).order_by('-created_at')),
+        ('predictions by method',
+         diseaseinfo.objects.using(using).filter(prediction_method='image').order_by('-created_at')),
+        ('predictions by disease',
+         diseaseinfo.objects.using(using).filter(diseasename='Acne').order_by('-created_at')),
+        ('doctor consultation counters',
+         consultation.objects.using(using).filter(doctor_id=1).values('doctor_id').annotate(
+             active=Count('id', filter=Q(status='active')),
+         )),
+        ('doctor consultations by status',
+         consultation.objects.using(using).filter(doctor_id=1, status='active')),
+        ('patient consultation history',
+         consultation.objects.using(using).filter(patient_id=1).order_by('-id')),
+        ('doctor consultation history',
+         consultation.objects.using(using).filter(doctor_id=1).order_by('-id')),
+        ('doctor reviews',
+         rating_review.objects.using(using).filter(doctor_id=1).order_by('-id')),
+        ('chat page',
+         Chat.objects.using(using).filter(consultation_id=1).order_by('-created', '-id')[:50]),
+        ('new chat messages',
+         Chat.objects.using(using).filter(consultation_id=1, id__gt=0).order_by('id')),
+        ('doctors by specialization',
+         doctor.objects.using(using).alias(specialization_lower=Lower('specialization')).filter(
+             specialization_lower='dermatologist',
+         )),
+    ]
+
+
+def _sqlite_full_scans(plan):
+    # "SCAN t" reads the table; "SCAN t USING [COVERING] INDEX i" walks an
+    # index in order, which on these queries means the filter did not use it
+    return [
+        line.strip() for line in plan.splitlines()
+        if ' SCAN ' in f' {line} ' and 'CONSTANT ROW' not in line
+    ]
+
+
+def _postgresql_full_scans(plan):
+    return [line.strip() for line in plan.splitlines() if 'Seq Scan' in line]
+
+
+FULL_SCAN_DETECTORS = {
+    'sqlite': _sqlite_full_scans,
+    'postgresql': _postgresql_full_scans,
+}
+
+
+class Command(BaseCommand):
+    help = 'Runs EXPLAIN on the hot queries and fails if any does a full table scan'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help='Database alias to check (default: default)')
+        parser.add_argument('--verbose', action='store_true', help='Print every plan')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        vendor = connections[using].vendor
+        detector = FULL_SCAN_DETECTORS.get(vendor)
+        if detector is None:
+            raise CommandError(f'Query plan checks support sqlite and postgresql, not {vendor}')
+
+        queries = hot_queries(using)
+        failures = []
+        for label, queryset in queries:
+            with transaction.atomic(using=using):
+                if vendor == 'postgresql':
+                    with connections[using].cursor() as cursor:
+                        cursor.execute('SET LOCAL enable_seqscan = off')
+                plan = queryset.explain()
+
+            scans = detector(plan)
+            if options['verbose']:
+                self.stdout.write(f'{label}:\n{plan}\n')
+            if scans:
+                failures.append(label)
+                self.stdout.write(self.style.ERROR(f'{label}: full scan'))
+                for line in scans:
+                    self.stdout.write(f'    {line}')
+            else:
+                self.stdout.write(f'{label}: ok')
+
+        if failures:
+            raise CommandError(f'{len(failures)} of {len(queries)} hot queries do a full scan: ' + ', '.join(failures))
+        self.stdout.write(self.style.SUCCESS(f'All hot queries use an index ({vendor})'))
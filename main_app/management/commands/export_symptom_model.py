@@ -0,0 +1,58 @@
+"""
+Django management command to export the symptom classifier as a memory-mapped bundle
+Usage: python manage.py export_symptom_model [--model PATH] [--output DIR]
+"""
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from main_app import model_registry
+from main_app.model_artifacts import export_bundle
+from main_app.nb_inference import NaiveBayesEngine
+from main_app.symptoms import SYMPTOMS
+
+
+class Command(BaseCommand):
+    help = 'Exports the joblib symptom model to an .npy bundle that is loaded with mmap'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--model',
+            type=str,
+            default=model_registry.SYMPTOM_MODEL_PATH,
+            help='joblib pickle to export (default: SYMPTOM_MODEL_PATH)'
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            default=model_registry.SYMPTOM_MODEL_BUNDLE,
+            help='Bundle directory to write (default: SYMPTOM_MODEL_BUNDLE)'
+        )
+
+    def handle(self, *args, **options):
+        import joblib as jb
+
+        start = time.perf_counter()
+        model = jb.load(options['model'])
+        pickle_seconds = time.perf_counter() - start
+
+        try:
+            manifest = export_bundle(model, options['output'], SYMPTOMS)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        start = time.perf_counter()
+        bundled = NaiveBayesEngine.from_bundle(options['output'])
+        bundle_seconds = time.perf_counter() - start
+
+        # One row per single symptom plus an all-zero row
+        inputs = np.vstack([np.eye(len(SYMPTOMS)), np.zeros((1, len(SYMPTOMS)))])
+        if not np.allclose(model.predict_proba(inputs), bundled.predict_proba(inputs)):
+            raise CommandError('Exported bundle does not reproduce the model predictions.')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Exported {len(manifest["classes"])} classes x {len(manifest["features"])} features '
+            f'to {options["output"]}'
+        ))
+        self.stdout.write(f'Load time: joblib {pickle_seconds * 1000:.1f} ms, bundle {bundle_seconds * 1000:.1f} ms')
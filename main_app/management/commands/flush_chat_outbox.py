@@ -0,0 +1,18 @@
+"""
+Django management command to move queued chat messages into the database
+Usage: python manage.py flush_chat_outbox
+
+The web workers flush the chat outbox on their own; run this to drain
+messages left behind by a crashed or stopped process, e.g. before a deploy.
+"""
+from django.core.management.base import BaseCommand
+
+from main_app import chat_outbox
+
+
+class Command(BaseCommand):
+    help = 'Writes every message waiting in the chat outbox to the database'
+
+    def handle(self, *args, **options):
+        moved = chat_outbox.flush_all()
+        self.stdout.write(self.style.SUCCESS(f'{moved} chat messages flushed from {chat_outbox.CHAT_OUTBOX_PATH}'))
@@ -0,0 +1,19 @@
+"""
+Django management command to recompute the disease analytics rollup
+Usage: python manage.py rebuild_disease_stats
+
+The disease_daily_stats table is kept up to date as predictions are stored.
+Run this after loading fixtures, after editing or bulk deleting predictions
+outside the app, or whenever the dashboard totals look off.
+"""
+from django.core.management.base import BaseCommand
+
+from main_app.analytics import rebuild_disease_daily_stats
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds disease_daily_stats from all stored predictions'
+
+    def handle(self, *args, **options):
+        rows = rebuild_disease_daily_stats()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt disease_daily_stats: {rows} rows'))
@@ -0,0 +1,18 @@
+"""
+Django management command to recompute the doctors' rating totals
+Usage: python manage.py repair_doctor_ratings
+
+doctor.rating_sum, rating_count and rating are maintained as reviews are
+submitted; run this after deleting or editing rating_review rows directly.
+"""
+from django.core.management.base import BaseCommand
+
+from main_app.ratings import recompute_doctor_ratings
+
+
+class Command(BaseCommand):
+    help = 'Recomputes doctor rating totals from rating_review'
+
+    def handle(self, *args, **options):
+        changed = recompute_doctor_ratings()
+        self.stdout.write(self.style.SUCCESS(f'Rating totals repaired for {changed} doctors'))
@@ -0,0 +1,51 @@
+"""
+Django management command to process queued asynchronous image prediction jobs
+Usage: python manage.py run_image_jobs [--once] [--interval SECONDS]
+
+Use together with IMAGE_JOB_WORKERS = 0 to run inference outside the web
+workers, or to drain jobs left queued by a restarted web process. Jobs left
+running by a dead worker for IMAGE_JOB_STALE_AFTER seconds are queued again
+first.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from main_app.image_jobs import claim_next_job, requeue_stale_jobs, run_scan_job
+
+
+class Command(BaseCommand):
+    help = 'Runs queued image_scan_job rows until interrupted'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit once the queue is empty instead of polling for new jobs'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=1.0,
+            help='Seconds to wait between polls of an empty queue (default: 1)'
+        )
+
+    def handle(self, *args, **options):
+        requeued = requeue_stale_jobs()
+        if requeued:
+            self.stdout.write(f'Requeued {requeued} stale image jobs')
+
+        processed = 0
+        while True:
+            job_id = claim_next_job()
+            if job_id is None:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+                continue
+
+            run_scan_job(job_id, claimed=True)
+            processed += 1
+            self.stdout.write(f'Processed image job {job_id}')
+
+        self.stdout.write(self.style.SUCCESS(f'{processed} image jobs processed'))
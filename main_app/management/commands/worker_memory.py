@@ -0,0 +1,99 @@
+"""
+Django management command to report the memory used by gunicorn workers
+Usage: python manage.py worker_memory [--pid MASTER_PID]
+
+Reads /proc, so it only works on Linux. PSS splits every shared page between
+the processes mapping it, so the PSS total is the real footprint of the
+server; a large gap between RSS and PSS means copy-on-write sharing works.
+"""
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+def _read_kb(path, fields):
+    values = {}
+    with open(path) as f:
+        for line in f:
+            key, _, rest = line.partition(':')
+            if key in fields:
+                values[key] = int(rest.split()[0])
+    return values
+
+
+def process_memory(pid):
+    """Return Rss, Pss, shared and private memory of `pid` in kB."""
+    fields = ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty')
+    values = _read_kb(f'/proc/{pid}/smaps_rollup', fields)
+    return {
+        'rss': values.get('Rss', 0),
+        'pss': values.get('Pss', 0),
+        'shared': values.get('Shared_Clean', 0) + values.get('Shared_Dirty', 0),
+        'private': values.get('Private_Clean', 0) + values.get('Private_Dirty', 0),
+    }
+
+
+def _processes():
+    """Yield (pid, ppid, argv) for every process visible in /proc."""
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                stat = f.read()
+            with open(f'/proc/{entry}/cmdline', 'rb') as f:
+                argv = f.read().decode(errors='replace').split('\0')
+        except OSError:
+            continue
+        # The command name in field 2 may contain spaces, ppid follows it
+        ppid = int(stat.rsplit(')', 1)[1].split()[1])
+        yield int(entry), ppid, argv
+
+
+class Command(BaseCommand):
+    help = 'Reports RSS, PSS and shared memory of the gunicorn master and its workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--pid',
+            type=int,
+            help='gunicorn master pid (default: every gunicorn master found)'
+        )
+
+    def handle(self, *args, **options):
+        if not os.path.exists('/proc/self/smaps_rollup'):
+            raise CommandError('worker_memory needs /proc/<pid>/smaps_rollup (Linux 4.14+).')
+
+        processes = list(_processes())
+        if options['pid']:
+            masters = [options['pid']]
+        else:
+            # argv[0] is 'gunicorn' or the interpreter running it
+            gunicorn = {
+                pid: ppid for pid, ppid, argv in processes
+                if any('gunicorn' in os.path.basename(arg) for arg in argv[:2])
+            }
+            masters = [pid for pid, ppid in gunicorn.items() if ppid not in gunicorn]
+
+        if not masters:
+            raise CommandError('No gunicorn master process found. Pass --pid.')
+
+        for master in masters:
+            workers = [pid for pid, ppid, _ in processes if ppid == master]
+            self.stdout.write(self.style.SUCCESS(f'gunicorn master {master}: {len(workers)} workers'))
+            self.stdout.write(f'{"pid":>8} {"role":<7} {"rss MB":>9} {"pss MB":>9} {"shared MB":>10} {"private MB":>11}')
+
+            total_pss = 0
+            for role, pid in [('master', master)] + [('worker', pid) for pid in workers]:
+                try:
+                    mem = process_memory(pid)
+                except OSError as e:
+                    self.stdout.write(self.style.WARNING(f'{pid:>8} {role:<7} unreadable: {e}'))
+                    continue
+                total_pss += mem['pss']
+                self.stdout.write(
+                    f'{pid:>8} {role:<7} {mem["rss"] / 1024:>9.1f} {mem["pss"] / 1024:>9.1f} '
+                    f'{mem["shared"] / 1024:>10.1f} {mem["private"] / 1024:>11.1f}'
+                )
+
+            self.stdout.write(f'Total PSS: {total_pss / 1024:.1f} MB')
@@ -0,0 +1,82 @@
+"""
+Request-scoped user and profile resolution.
+
+ProfileMiddleware replaces the lazy request.user of AuthenticationMiddleware
+with one that is loaded together with its patient and doctor rows in one
+select_related query, so views and templates that reach user.patient or
+user.doctor do not query for them again. It also sets request.profile to
+that patient or doctor row, which evaluates false for anonymous users and
+users without a profile. Both stay lazy: a request that never looks at them
+runs no query.
+
+Nothing is kept between requests. The loaded user is only used when it
+matches the session exactly as Django's own get_user() checks it (user id,
+authentication backend, active flag and session auth hash); anything else
+falls back to Django's get_user(), which also flushes a stale session.
+"""
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.core.exceptions import ObjectDoesNotExist
+from django.utils.crypto import constant_time_compare
+from django.utils.functional import SimpleLazyObject
+
+
+def _matches_session(request, user):
+    session = request.session
+    session_hash = session.get(HASH_SESSION_KEY)
+    return (
+        str(user.pk) == str(session.get(SESSION_KEY))
+        and session.get(BACKEND_SESSION_KEY) in settings.AUTHENTICATION_BACKENDS
+        and user.is_active
+        and bool(session_hash)
+        and constant_time_compare(session_hash, user.get_session_auth_hash())
+    )
+
+
+def _resolve_user(request, fallback):
+    user_id = request.session.get(SESSION_KEY)
+    if user_id is None:
+        return fallback
+
+    user = get_user_model()._default_manager.select_related('patient', 'doctor').filter(pk=user_id).first()
+    if user is None or not _matches_session(request, user):
+        # Let Django decide (and flush the session if it has to)
+        return fallback
+    return user
+
+
+def profile_of(user):
+    """Returns: the patient or doctor row of `user`, or None."""
+    if not user.is_authenticated:
+        return None
+    for name in ('patient', 'doctor'):
+        try:
+            return getattr(user, name)
+        except ObjectDoesNotExist:
+            pass
+    return None
+
+
+def session_user(request, session_key):
+    """
+    The user named by request.session[session_key] ('patientusername' or
+    'doctorusername'). That is normally the logged-in user, which is then
+    returned without a query; any other user is loaded with its profile.
+    """
+    username = request.session[session_key]
+    if request.user.is_authenticated and request.user.username == username:
+        return request.user
+    return get_user_model()._default_manager.select_related('patient', 'doctor').get(username=username)
+
+
+class ProfileMiddleware:
+    """Must come after AuthenticationMiddleware."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        fallback = request.user
+        request.user = SimpleLazyObject(lambda: _resolve_user(request, fallback))
+        request.profile = SimpleLazyObject(lambda: profile_of(request.user))
+        return self.get_response(request)
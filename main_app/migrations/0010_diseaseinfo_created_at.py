@@ -0,0 +1,49 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:40
+
+from django.db import migrations, models
+from django.db.models import DateTimeField, OuterRef, Subquery
+from django.db.models.functions import Cast, Coalesce
+import django.utils.timezone
+
+
+def backfill_created_at(apps, schema_editor):
+    """
+    diseaseinfo had no timestamp before this migration. Rows linked to a
+    consultation get the consultation date, image predictions made by a
+    scan job the time the job was queued, in one UPDATE. Rows with neither
+    stay NULL: their date is unknown, and made-up dates would only distort
+    the prediction time series.
+    """
+    diseaseinfo = apps.get_model('main_app', 'diseaseinfo')
+    consultation = apps.get_model('main_app', 'consultation')
+    image_scan_job = apps.get_model('main_app', 'image_scan_job')
+
+    consultation_date = (
+        consultation.objects.filter(diseaseinfo=OuterRef('pk'))
+        .order_by('consultation_date')
+        .annotate(at=Cast('consultation_date', DateTimeField()))
+        .values('at')[:1]
+    )
+    job_created = image_scan_job.objects.filter(diseaseinfo=OuterRef('pk')).values('created')[:1]
+    diseaseinfo.objects.update(created_at=Coalesce(Subquery(consultation_date), Subquery(job_created)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0009_image_scan_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='diseaseinfo',
+            name='created_at',
+            field=models.DateTimeField(db_index=True, null=True),
+        ),
+        migrations.RunPython(backfill_created_at, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='diseaseinfo',
+            name='created_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, null=True),
+        ),
+    ]
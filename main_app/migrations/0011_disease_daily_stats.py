@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0010_diseaseinfo_created_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='disease_daily_stats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(null=True)),
+                ('diseasename', models.CharField(max_length=200)),
+                ('prediction_method', models.CharField(max_length=20)),
+                ('count', models.IntegerField(default=0)),
+                ('confidence_sum', models.FloatField(default=0)),
+            ],
+            options={
+                'unique_together': {('date', 'diseasename', 'prediction_method')},
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+from django.db import migrations
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill_rollup(apps, schema_editor):
+    diseaseinfo = apps.get_model('main_app', 'diseaseinfo')
+    disease_daily_stats = apps.get_model('main_app', 'disease_daily_stats')
+
+    rows = (
+        diseaseinfo.objects
+        .annotate(day=TruncDate('created_at'))
+        .values('day', 'diseasename', 'prediction_method')
+        .annotate(n=Count('id'), confidence_total=Sum('confidence'))
+        .order_by()
+    )
+    disease_daily_stats.objects.bulk_create([
+        disease_daily_stats(
+            date=row['day'],
+            diseasename=row['diseasename'],
+            prediction_method=row['prediction_method'],
+            count=row['n'],
+            confidence_sum=float(row['confidence_total'] or 0),
+        )
+        for row in rows
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0011_disease_daily_stats'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_rollup, migrations.RunPython.noop),
+    ]
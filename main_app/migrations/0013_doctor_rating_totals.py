@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:46
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_rating_totals(apps, schema_editor):
+    doctor = apps.get_model('main_app', 'doctor')
+    rating_review = apps.get_model('main_app', 'rating_review')
+
+    rows = (
+        rating_review.objects.filter(doctor__isnull=False)
+        .values('doctor')
+        .annotate(total=Sum('rating'), count=Count('id'))
+        .order_by()
+    )
+    for row in rows:
+        total = row['total'] or 0
+        doctor.objects.filter(pk=row['doctor']).update(
+            rating_sum=total, rating_count=row['count'], rating=total // row['count'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0012_backfill_disease_daily_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='doctor',
+            name='rating_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='rating_sum',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_rating_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:50
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0013_doctor_rating_totals'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='consultation',
+            index=models.Index(fields=['doctor', 'status'], name='consultation_doctor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='consultation',
+            index=models.Index(fields=['patient', 'id'], name='consultation_patient_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='diseaseinfo',
+            index=models.Index(fields=['patient', 'created_at'], name='diseaseinfo_patient_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='diseaseinfo',
+            index=models.Index(fields=['prediction_method', 'created_at'], name='diseaseinfo_method_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='diseaseinfo',
+            index=models.Index(fields=['diseasename', 'created_at'], name='diseaseinfo_disease_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='doctor',
+            index=models.Index(django.db.models.functions.text.Lower('specialization'), name='doctor_specialization_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rating_review',
+            index=models.Index(fields=['doctor', 'id'], name='rating_review_doctor_idx'),
+        ),
+    ]
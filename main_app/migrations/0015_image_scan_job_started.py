@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0014_hot_table_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image_scan_job',
+            name='started',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
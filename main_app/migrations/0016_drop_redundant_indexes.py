@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:48
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0015_image_scan_job_started'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='consultation',
+            name='consultation_patient_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='rating_review',
+            name='rating_review_doctor_idx',
+        ),
+    ]
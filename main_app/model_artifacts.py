@@ -0,0 +1,78 @@
+"""
+Memory-mapped artifact format for the symptom classifier.
+
+A bundle is a directory holding one .npy file per fitted MultinomialNB array
+plus a manifest.json with the class labels, the feature (symptom) order and
+the estimator parameters. The arrays are opened with np.load(mmap_mode='r'),
+so loading a bundle costs almost nothing and its pages are shared through the
+OS page cache by every process that maps it, across restarts too.
+"""
+import json
+import os
+
+import numpy as np
+
+
+BUNDLE_FORMAT = 1
+MANIFEST_NAME = 'manifest.json'
+
+# Fitted MultinomialNB attributes stored as arrays; classes_ lives in the manifest
+BUNDLE_ARRAYS = ('class_count_', 'feature_count_', 'feature_log_prob_', 'class_log_prior_')
+
+
+def export_bundle(model, path, features):
+    """Write the fitted MultinomialNB `model` as a bundle directory at `path`."""
+    if len(features) != model.feature_log_prob_.shape[1]:
+        raise ValueError(
+            f'{len(features)} feature names given for a model with '
+            f'{model.feature_log_prob_.shape[1]} features'
+        )
+
+    os.makedirs(path, exist_ok=True)
+
+    arrays = {}
+    for name in BUNDLE_ARRAYS:
+        filename = name.rstrip('_') + '.npy'
+        np.save(os.path.join(path, filename), np.ascontiguousarray(getattr(model, name), dtype=np.float64))
+        arrays[name] = filename
+
+    class_prior = model.class_prior
+    manifest = {
+        'format': BUNDLE_FORMAT,
+        'estimator': type(model).__name__,
+        'params': {
+            'alpha': float(model.alpha),
+            'fit_prior': bool(model.fit_prior),
+            'class_prior': None if class_prior is None else [float(p) for p in class_prior],
+        },
+        'classes': [str(c) for c in model.classes_],
+        'features': list(features),
+        'arrays': arrays,
+    }
+    with open(os.path.join(path, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    return manifest
+
+
+def load_bundle(path, mmap_mode='r', features=None):
+    """
+    Open a bundle directory. With `features`, the bundle must have been
+    exported for exactly that feature order, or ValueError is raised.
+    Returns: (manifest, arrays) where arrays maps attribute names to
+    read-only memory-mapped arrays.
+    """
+    with open(os.path.join(path, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+
+    if manifest.get('format') != BUNDLE_FORMAT:
+        raise ValueError(f'Unsupported model bundle format {manifest.get("format")!r} in {path}')
+    if features is not None and manifest.get('features') != list(features):
+        raise ValueError(f'Model bundle in {path} was exported for a different symptom list')
+
+    arrays = {
+        name: np.load(os.path.join(path, filename), mmap_mode=mmap_mode)
+        for name, filename in manifest['arrays'].items()
+    }
+    return manifest, arrays
+
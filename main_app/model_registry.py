@@ -0,0 +1,191 @@
+"""
+Process wide registry for the prediction models.
+
+Every model is loaded lazily on first use and then shared by all threads of
+the process, so importing the views never pays for joblib or TensorFlow.
+Paths are resolved from BASE_DIR and can be overridden in settings with
+SYMPTOM_MODEL_PATH, SYMPTOM_MODEL_BUNDLE, CNN_MODEL_PATH and CNN_LABELS_PATH.
+
+The symptom classifier is served by the pure NumPy NaiveBayesEngine, read
+from the memory-mapped bundle written by `manage.py export_symptom_model`
+when one exists and matches SYMPTOMS, and from the joblib pickle otherwise.
+"""
+import json
+import os
+import threading
+
+from django.conf import settings
+
+
+SYMPTOM_MODEL_PATH = getattr(settings, 'SYMPTOM_MODEL_PATH', os.path.join(settings.BASE_DIR, 'trained_model'))
+SYMPTOM_MODEL_BUNDLE = getattr(settings, 'SYMPTOM_MODEL_BUNDLE', os.path.join(settings.BASE_DIR, 'models', 'symptom_model'))
+CNN_MODEL_PATH = getattr(settings, 'CNN_MODEL_PATH', os.path.join(settings.BASE_DIR, 'models', 'skin_cnn.h5'))
+CNN_LABELS_PATH = getattr(settings, 'CNN_LABELS_PATH', os.path.join(settings.BASE_DIR, 'models', 'skin_cnn_labels.json'))
+
+# How long the CNN micro-batcher waits for concurrent uploads, and its batch cap
+IMAGE_BATCH_WINDOW_MS = getattr(settings, 'IMAGE_BATCH_WINDOW_MS', 5)
+IMAGE_BATCH_MAX_SIZE = getattr(settings, 'IMAGE_BATCH_MAX_SIZE', 16)
+
+# Used when a CNN model is present but its labels file is not
+DEFAULT_IMAGE_LABELS = [
+    "Acne", "Fungal infection", "Psoriasis", "Impetigo", "Chicken pox",
+    "Eczema", "Dermatitis", "Melanoma", "Basal cell carcinoma",
+    "Squamous cell carcinoma", "Rosacea", "Vitiligo", "Hives",
+    "Scabies", "Ringworm", "Seborrheic dermatitis", "Lichen planus",
+    "Melasma", "Keratosis pilaris", "Cold sore"
+]
+
+_models = {}
+# Re-entrant: loading the image batcher loads the image model first
+_lock = threading.RLock()
+
+
+def _load_once(name, loader):
+    """Return the cached model `name`, loading it under the lock on first use."""
+    try:
+        return _models[name]
+    except KeyError:
+        pass
+
+    with _lock:
+        if name not in _models:
+            _models[name] = loader()
+        return _models[name]
+
+
+def _load_symptom_model():
+    from .model_artifacts import MANIFEST_NAME
+    from .nb_inference import NaiveBayesEngine
+    from .symptoms import SYMPTOMS
+
+    if os.path.exists(os.path.join(SYMPTOM_MODEL_BUNDLE, MANIFEST_NAME)):
+        try:
+            return NaiveBayesEngine.from_bundle(SYMPTOM_MODEL_BUNDLE, features=SYMPTOMS)
+        except ValueError as e:
+            # A stale bundle would silently shift every symptom column
+            print(f"Ignoring symptom model bundle: {e}")
+
+    # Unpickling still needs scikit-learn; export a bundle to avoid it
+    import joblib as jb
+    return NaiveBayesEngine.from_estimator(jb.load(SYMPTOM_MODEL_PATH))
+
+
+def _load_image_model():
+    if not os.path.exists(CNN_MODEL_PATH):
+        print(f"CNN model not found at {CNN_MODEL_PATH}")
+        return None, None
+
+    try:
+        from tensorflow import keras
+        image_model = keras.models.load_model(CNN_MODEL_PATH)
+    except Exception as e:
+        print(f"Warning: could not load CNN image model: {e}")
+        print("Falling back to basic image analysis.")
+        return None, None
+
+    if os.path.exists(CNN_LABELS_PATH):
+        with open(CNN_LABELS_PATH) as f:
+            image_labels = json.load(f)
+        print("Loaded CNN image model for skin disease detection with labels.")
+    else:
+        print(f"Warning: CNN model loaded but labels file not found at {CNN_LABELS_PATH}")
+        print("Using default skin disease labels.")
+        image_labels = DEFAULT_IMAGE_LABELS
+
+    return image_model, image_labels
+
+
+def get_symptom_model():
+    """Return the symptom based classifier as a NaiveBayesEngine."""
+    return _load_once('symptom', _load_symptom_model)
+
+
+def get_image_model():
+    """
+    Return the CNN skin image classifier and its labels.
+    Returns: (model, labels), or (None, None) when no CNN model is available.
+    """
+    return _load_once('image', _load_image_model)
+
+
+def worker_threads():
+    """Returns: the threads of this gunicorn worker, or None outside gunicorn."""
+    # Set by gunicorn.conf.py's post_fork from the worker's real config; unset
+    # under runserver, which serves every request on its own thread
+    threads = os.environ.get('GUNICORN_THREADS')
+    return int(threads) if threads else None
+
+
+def _load_image_batcher():
+    from .image_batcher import MicroBatcher
+
+    image_model, _ = get_image_model()
+    if image_model is None:
+        return None
+    if worker_threads() == 1:
+        # A single-threaded worker never has a concurrent upload to batch
+        # with, so waiting for one would only add latency
+        return None
+    return MicroBatcher(
+        lambda batch: image_model.predict(batch, verbose=0),
+        max_batch_size=IMAGE_BATCH_MAX_SIZE,
+        max_wait=IMAGE_BATCH_WINDOW_MS / 1000,
+    )
+
+
+def get_image_batcher():
+    """
+    Return the MicroBatcher that runs the CNN over concurrent uploads together.
+    Returns None when no CNN model is available or the worker is single-threaded.
+    """
+    return _load_once('image_batcher', _load_image_batcher)
+
+
+def preload(image=True):
+    """Load the models now instead of on the first request that needs them."""
+    get_symptom_model()
+    if image:
+        get_image_model()
+
+
+def post_fork(server, worker):
+    """
+    gunicorn post_fork hook that preloads the models in every new worker.
+    Set PRELOAD_IMAGE_MODEL=0 to skip the CNN on symptom only deployments.
+    """
+    preload(image=os.environ.get('PRELOAD_IMAGE_MODEL', '1') != '0')
+
+
+def share_across_fork():
+    """
+    Prepare the loaded models to be inherited by forked workers.
+
+    The weight arrays are made contiguous and read-only so no worker ever
+    writes to (and privately copies) their pages, and gc.freeze() moves every
+    object loaded so far out of the collector's reach so that garbage
+    collection in the workers does not dirty the pages holding their headers.
+    """
+    import gc
+    import numpy as np
+
+    model = get_symptom_model()
+    for name, value in list(vars(model).items()):
+        if isinstance(value, np.ndarray):
+            value = np.ascontiguousarray(value)
+            value.setflags(write=False)
+            setattr(model, name, value)
+
+    gc.collect()
+    gc.freeze()
+
+
+def preload_shared():
+    """
+    gunicorn master hook for preload_app mode: load the symptom model once in
+    the master so every forked worker shares it copy-on-write.
+
+    The CNN is deliberately left to post_fork. TensorFlow starts thread pools
+    when a model is loaded and is not safe to use across fork().
+    """
+    get_symptom_model()
+    share_across_fork()
@@ -1,6 +1,9 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Lower
 from django.contrib.auth.models import User
+from django.utils import timezone
 import json
+import uuid
 
 from datetime import date
 
@@ -56,6 +59,25 @@ class doctor(models.Model):
 
     rating = models.IntegerField(default=0)
 
+    # Running totals of the doctor's rating_review rows, kept up to date by
+    # ratings.submit_rating; rating is their truncated average
+    rating_sum = models.IntegerField(default=0)
+    rating_count = models.IntegerField(default=0)
+
+    class Meta:
+        # consult_a_doctor matches specialization case-insensitively on
+        # Lower('specialization'), which this index serves
+        indexes = [
+            models.Index(Lower('specialization'), name='doctor_specialization_idx'),
+        ]
+
+    @property
+    def average_rating(self):
+        """Average review rating rounded to one decimal, 0 without reviews."""
+        if not self.rating_count:
+            return 0
+        return round(self.rating_sum / self.rating_count, 1)
+
     @property
     def age(self):
         today = date.today()
@@ -80,6 +102,18 @@ class diseaseinfo(models.Model):
     consultdoctor = models.CharField(max_length = 200)
     skin_image = models.ImageField(upload_to='skin_images/', blank=True, null=True)  # For image-based prediction
     prediction_method = models.CharField(max_length=20, default='symptoms', choices=[('symptoms', 'Symptoms'), ('image', 'Image Scan')])
+    # NULL for predictions stored before the column existed whose date could
+    # not be recovered (see migration 0010)
+    created_at = models.DateTimeField(default=timezone.now, null=True, db_index=True)
+
+    class Meta:
+        # Per-patient history and the per-method / per-disease breakdowns,
+        # each newest first
+        indexes = [
+            models.Index(fields=['patient', 'created_at'], name='diseaseinfo_patient_idx'),
+            models.Index(fields=['prediction_method', 'created_at'], name='diseaseinfo_method_idx'),
+            models.Index(fields=['diseasename', 'created_at'], name='diseaseinfo_disease_idx'),
+        ]
     
     def __init__(self, *args, **kwargs):
         # Convert list to JSON string if provided
@@ -100,7 +134,50 @@ class diseaseinfo(models.Model):
         # Convert list to JSON if it's still a list
         if isinstance(self.symptomsname, list):
             self.symptomsname = json.dumps(self.symptomsname)
-        super().save(*args, **kwargs)
+        # post_save updates the rollup (signals.py); commit both or neither
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
+
+
+
+class disease_daily_stats(models.Model):
+
+    # Rollup of diseaseinfo maintained incrementally (see analytics.py);
+    # `manage.py rebuild_disease_stats` recomputes it from scratch. Undated
+    # predictions are rolled up under date NULL: they count in the totals
+    # but not in any time series.
+    date = models.DateField(null=True)
+    diseasename = models.CharField(max_length = 200)
+    prediction_method = models.CharField(max_length=20)
+
+    count = models.IntegerField(default=0)
+    confidence_sum = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ('date', 'diseasename', 'prediction_method')
+
+
+
+class image_scan_job(models.Model):
+
+    STATUS_CHOICES = [('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    patient = models.ForeignKey(patient , null=True, on_delete=models.SET_NULL)
+
+    skin_image = models.ImageField(upload_to='skin_images/')
+    status = models.CharField(max_length=10, default='queued', choices=STATUS_CHOICES)
+    diseaseinfo = models.OneToOneField(diseaseinfo, null=True, blank=True, on_delete=models.SET_NULL)
+    error = models.CharField(max_length=500, blank=True)
+
+    created = models.DateTimeField(auto_now_add=True)
+    # Set when a worker claims the job; what requeue_stale_jobs() ages from
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
 
 
 
@@ -112,6 +189,14 @@ class consultation(models.Model):
     consultation_date = models.DateField()
     status = models.CharField(max_length = 20)
 
+    class Meta:
+        # Doctor dashboard counters filter on (doctor, status). Consultation
+        # histories list a patient's or doctor's consultations by id, which
+        # the foreign key indexes already serve
+        indexes = [
+            models.Index(fields=['doctor', 'status'], name='consultation_doctor_idx'),
+        ]
+
 
 
 
@@ -127,12 +212,8 @@ class rating_review(models.Model):
 
     @property
     def rating_is(self):
-        new_rating = 0
-        rating_obj = rating_review.objects.filter(doctor=self.doctor)
-        for i in rating_obj:
-            new_rating += i.rating
-       
-        new_rating = new_rating/len(rating_obj)
-        new_rating = int(new_rating)
-        
-        return new_rating
\ No newline at end of file
+        # Read from the doctor's running totals instead of loading every review
+        doctor_obj = self.doctor
+        if doctor_obj is None or not doctor_obj.rating_count:
+            return 0
+        return int(doctor_obj.rating_sum / doctor_obj.rating_count)
\ No newline at end of file
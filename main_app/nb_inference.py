@@ -0,0 +1,58 @@
+"""
+Pure NumPy inference for the MultinomialNB symptom classifier.
+
+Predicting with a fitted MultinomialNB is a matrix product of the binary
+symptom rows with feature_log_prob_, plus class_log_prior_, normalised with
+a softmax. NaiveBayesEngine does exactly that, so a web worker that loads the
+classifier from a bundle never has to import scikit-learn or SciPy.
+"""
+import numpy as np
+
+from .model_artifacts import load_bundle
+
+
+class NaiveBayesEngine:
+    """Drop-in replacement for MultinomialNB.predict/predict_proba."""
+
+    def __init__(self, classes, feature_log_prob, class_log_prior):
+        self.classes_ = np.asarray(classes, dtype=object)
+        self.feature_log_prob_ = feature_log_prob
+        self.class_log_prior_ = class_log_prior
+
+        if self.feature_log_prob_.shape[0] != len(self.classes_) or len(self.class_log_prior_) != len(self.classes_):
+            raise ValueError('Class count does not match the shape of the model parameters')
+
+    @classmethod
+    def from_estimator(cls, model):
+        """Build an engine from a fitted scikit-learn MultinomialNB."""
+        return cls(
+            [str(c) for c in model.classes_],
+            np.ascontiguousarray(model.feature_log_prob_, dtype=np.float64),
+            np.ascontiguousarray(model.class_log_prior_, dtype=np.float64),
+        )
+
+    @classmethod
+    def from_bundle(cls, path, features=None):
+        """Build an engine on the memory-mapped arrays of a bundle directory."""
+        manifest, arrays = load_bundle(path, features=features)
+        return cls(manifest['classes'], arrays['feature_log_prob_'], arrays['class_log_prior_'])
+
+    @property
+    def n_features_in_(self):
+        return self.feature_log_prob_.shape[1]
+
+    def joint_log_likelihood(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f'Expected input of shape (n, {self.n_features_in_}), got {X.shape}')
+        return X @ self.feature_log_prob_.T + self.class_log_prior_
+
+    def predict_proba(self, X):
+        jll = self.joint_log_likelihood(X)
+        jll -= jll.max(axis=1, keepdims=True)
+        np.exp(jll, out=jll)
+        jll /= jll.sum(axis=1, keepdims=True)
+        return jll
+
+    def predict(self, X):
+        return self.classes_[self.joint_log_likelihood(X).argmax(axis=1)]
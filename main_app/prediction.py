@@ -0,0 +1,68 @@
+"""
+Symptom based disease prediction helpers shared by the prediction views.
+"""
+import numpy as np
+
+
+# Specialist to consult for each disease the symptom classifier can predict.
+SPECIALISTS = {
+    "Rheumatologist": ['Osteoarthristis', 'Arthritis'],
+    "Cardiologist": ['Heart attack', 'Bronchial Asthma', 'Hypertension '],
+    "ENT specialist": ['(vertigo) Paroymsal  Positional Vertigo', 'Hypothyroidism'],
+    "Orthopedist": [],
+    "Neurologist": ['Varicose veins', 'Paralysis (brain hemorrhage)', 'Migraine', 'Cervical spondylosis'],
+    "Allergist/Immunologist": ['Allergy', 'Pneumonia', 'AIDS', 'Common Cold', 'Tuberculosis', 'Malaria',
+                               'Dengue', 'Typhoid'],
+    "Urologist": ['Urinary tract infection', 'Dimorphic hemmorhoids(piles)'],
+    "Dermatologist": ['Acne', 'Chicken pox', 'Fungal infection', 'Psoriasis', 'Impetigo'],
+    "Gastroenterologist": ['Peptic ulcer diseae', 'GERD', 'Chronic cholestasis', 'Drug Reaction',
+                           'Gastroenteritis', 'Hepatitis E', 'Alcoholic hepatitis', 'Jaundice', 'hepatitis A',
+                           'Hepatitis B', 'Hepatitis C', 'Hepatitis D', 'Diabetes ', 'Hypoglycemia'],
+}
+
+SPECIALIST_BY_DISEASE = {
+    disease: specialist
+    for specialist, diseases in SPECIALISTS.items()
+    for disease in diseases
+}
+
+
+def consult_doctor_for(disease):
+    """Return the specialist a patient with `disease` should consult."""
+    return SPECIALIST_BY_DISEASE.get(disease, "other")
+
+
+def predict_batch(model, inputs):
+    """
+    Predict every row of an encoded symptom matrix with one predict_proba call.
+    Returns: (labels, confidences) where confidences are percentages.
+    """
+    proba = model.predict_proba(inputs)
+    best = proba.argmax(axis=1)
+    labels = model.classes_[best]
+    confidences = proba[np.arange(len(best)), best] * 100
+    return labels, confidences
+
+
+def top_k_diseases(model, proba, k=3):
+    """
+    Rank the k most likely diseases of one predict_proba row.
+    Returns: list of dicts with 'disease', 'confidence' (percentage) and
+    'consultdoctor', most likely first.
+    """
+    k = max(1, min(k, len(proba)))
+    best = np.argpartition(proba, -k)[-k:]
+    best = best[np.argsort(proba[best])[::-1]]
+    return [
+        {
+            'disease': str(model.classes_[i]),
+            'confidence': float(proba[i]) * 100,
+            'consultdoctor': consult_doctor_for(str(model.classes_[i])),
+        }
+        for i in best
+    ]
+
+
+def predict_top_k(model, inputs, k=3):
+    """Predict a single encoded symptom row with one predict_proba call."""
+    return top_k_diseases(model, model.predict_proba(inputs)[0], k)
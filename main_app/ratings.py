@@ -0,0 +1,64 @@
+"""
+Doctor ratings.
+
+Every doctor row carries rating_sum and rating_count, the running totals of
+its rating_review rows, so showing a doctor's average never aggregates the
+reviews and submitting a rating costs the same however many reviews exist.
+"""
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from .models import doctor, rating_review
+
+
+# Range of the stars a patient can give
+RATING_MIN = 1
+RATING_MAX = 5
+
+
+def submit_rating(patient_obj, doctor_obj, rating, review):
+    """
+    Store a review and add it to the doctor's totals in one transaction.
+    The totals are updated with F() expressions, so concurrent submissions
+    for the same doctor cannot lose an update.
+    Returns: the new rating_review
+    Raises: ValueError for a rating outside RATING_MIN..RATING_MAX
+    """
+    if not RATING_MIN <= rating <= RATING_MAX:
+        raise ValueError(f'rating must be between {RATING_MIN} and {RATING_MAX}')
+
+    with transaction.atomic():
+        rating_obj = rating_review.objects.create(patient=patient_obj, doctor=doctor_obj, rating=rating, review=review)
+        if doctor_obj is not None:
+            # Integer division, i.e. the truncated average doctor.rating always held
+            doctor.objects.filter(pk=doctor_obj.pk).update(
+                rating_sum=F('rating_sum') + rating,
+                rating_count=F('rating_count') + 1,
+                rating=(F('rating_sum') + rating) / (F('rating_count') + 1),
+            )
+    return rating_obj
+
+
+def recompute_doctor_ratings():
+    """
+    Rebuild every doctor's rating totals from rating_review with one grouped query.
+    Returns: number of doctors whose totals changed.
+    """
+    totals = {
+        row['doctor']: (row['total'] or 0, row['count'])
+        for row in rating_review.objects.filter(doctor__isnull=False)
+        .values('doctor')
+        .annotate(total=Sum('rating'), count=Count('id'))
+        .order_by()
+    }
+
+    changed = []
+    for doctor_obj in doctor.objects.only('pk', 'rating', 'rating_sum', 'rating_count'):
+        rating_sum, rating_count = totals.get(doctor_obj.pk, (0, 0))
+        rating = rating_sum // rating_count if rating_count else 0
+        if (doctor_obj.rating_sum, doctor_obj.rating_count, doctor_obj.rating) != (rating_sum, rating_count, rating):
+            doctor_obj.rating_sum, doctor_obj.rating_count, doctor_obj.rating = rating_sum, rating_count, rating
+            changed.append(doctor_obj)
+
+    doctor.objects.bulk_update(changed, ['rating_sum', 'rating_count', 'rating'], batch_size=500)
+    return len(changed)
@@ -0,0 +1,38 @@
+"""
+Keep derived data in step with the models it is computed from.
+
+The disease_daily_stats rollup is updated inside the transaction that stores
+the prediction: diseaseinfo.save() and delete() open one for the row and its
+signals, and bulk inserts call record_predictions() in their own. Edits that change the day, disease or method of an existing
+prediction are not tracked; `manage.py rebuild_disease_stats` recomputes the
+rollup.
+
+A doctor's cached dashboard counters are dropped whenever one of their
+consultations is saved or deleted.
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .analytics import record_predictions
+from .doctor_stats import invalidate_doctor_stats
+from .models import consultation, diseaseinfo
+
+
+@receiver(post_save, sender=diseaseinfo)
+def add_to_rollup(sender, instance, created, raw=False, **kwargs):
+    # raw saves come from loaddata; rebuild the rollup after loading fixtures
+    if created and not raw:
+        record_predictions([instance])
+
+
+@receiver(post_delete, sender=diseaseinfo)
+def remove_from_rollup(sender, instance, **kwargs):
+    record_predictions([instance], sign=-1)
+
+
+@receiver(post_save, sender=consultation)
+@receiver(post_delete, sender=consultation)
+def drop_doctor_stats(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate_doctor_stats(instance.doctor_id))
+
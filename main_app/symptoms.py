@@ -0,0 +1,84 @@
+"""
+Symptom feature encoding for the symptom based disease classifier.
+
+SYMPTOMS is the column order the classifier in `trained_model` was trained
+with, so a patient's selected symptoms can be turned into a model input row
+by looking up their columns instead of scanning the whole list.
+"""
+import numpy as np
+
+
+SYMPTOMS = ['itching','skin_rash','nodal_skin_eruptions','continuous_sneezing','shivering','chills','joint_pain',
+  'stomach_pain','acidity','ulcers_on_tongue','muscle_wasting','vomiting','burning_micturition','spotting_ urination',
+  'fatigue','weight_gain','anxiety','cold_hands_and_feets','mood_swings','weight_loss','restlessness','lethargy',
+  'patches_in_throat','irregular_sugar_level','cough','high_fever','sunken_eyes','breathlessness','sweating',
+  'dehydration','indigestion','headache','yellowish_skin','dark_urine','nausea','loss_of_appetite','pain_behind_the_eyes',
+  'back_pain','constipation','abdominal_pain','diarrhoea','mild_fever','yellow_urine',
+  'yellowing_of_eyes','acute_liver_failure','fluid_overload','swelling_of_stomach',
+  'swelled_lymph_nodes','malaise','blurred_and_distorted_vision','phlegm','throat_irritation',
+  'redness_of_eyes','sinus_pressure','runny_nose','congestion','chest_pain','weakness_in_limbs',
+  'fast_heart_rate','pain_during_bowel_movements','pain_in_anal_region','bloody_stool',
+  'irritation_in_anus','neck_pain','dizziness','cramps','bruising','obesity','swollen_legs',
+  'swollen_blood_vessels','puffy_face_and_eyes','enlarged_thyroid','brittle_nails',
+  'swollen_extremeties','excessive_hunger','extra_marital_contacts','drying_and_tingling_lips',
+  'slurred_speech','knee_pain','hip_joint_pain','muscle_weakness','stiff_neck','swelling_joints',
+  'movement_stiffness','spinning_movements','loss_of_balance','unsteadiness',
+  'weakness_of_one_body_side','loss_of_smell','bladder_discomfort','foul_smell_of urine',
+  'continuous_feel_of_urine','passage_of_gases','internal_itching','toxic_look_(typhos)',
+  'depression','irritability','muscle_pain','altered_sensorium','red_spots_over_body','belly_pain',
+  'abnormal_menstruation','dischromic _patches','watering_from_eyes','increased_appetite','polyuria','family_history','mucoid_sputum',
+  'rusty_sputum','lack_of_concentration','visual_disturbances','receiving_blood_transfusion',
+  'receiving_unsterile_injections','coma','stomach_bleeding','distention_of_abdomen',
+  'history_of_alcohol_consumption','fluid_overload','blood_in_sputum','prominent_veins_on_calf',
+  'palpitations','painful_walking','pus_filled_pimples','blackheads','scurring','skin_peeling',
+  'silver_like_dusting','small_dents_in_nails','inflammatory_nails','blister','red_sore_around_nose',
+  'yellow_crust_ooze']
+
+
+def build_symptom_index(features):
+    """Map every symptom name to the tuple of model columns it occupies."""
+    # 'fluid_overload' appears twice in the training columns, so a name can
+    # own more than one column.
+    index = {}
+    for column, name in enumerate(features):
+        index.setdefault(name, []).append(column)
+    return {name: tuple(columns) for name, columns in index.items()}
+
+
+SYMPTOM_INDEX = build_symptom_index(SYMPTOMS)
+N_FEATURES = len(SYMPTOMS)
+
+
+def encode_symptoms(symptoms, out=None):
+    """
+    Encode a list of symptom names as a single binary model input row.
+    Returns: (row, unknown) where row is a (1, N_FEATURES) float64 array
+    and unknown lists the names that are not model features.
+    """
+    if out is None:
+        out = np.zeros((1, N_FEATURES), dtype=np.float64)
+
+    columns = []
+    unknown = []
+    for name in symptoms:
+        found = SYMPTOM_INDEX.get(name)
+        if found is None:
+            unknown.append(name)
+        else:
+            columns.extend(found)
+
+    out[0, columns] = 1
+    return out, unknown
+
+
+def encode_symptom_sets(symptom_sets):
+    """
+    Encode several symptom lists as one (N, N_FEATURES) model input matrix.
+    Returns: (matrix, unknown) where unknown[i] lists the names of row i
+    that are not model features.
+    """
+    matrix = np.zeros((len(symptom_sets), N_FEATURES), dtype=np.float64)
+    unknown = []
+    for i, symptoms in enumerate(symptom_sets):
+        unknown.append(encode_symptoms(symptoms, out=matrix[i:i + 1])[1])
+    return matrix, unknown
@@ -1,3 +1,1170 @@
-from django.test import TestCase
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from importlib import import_module
+from unittest import mock
 
-# Create your tests here.
+import joblib as jb
+import numpy as np
+from django.apps import apps as django_apps
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, reset_queries
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from chats.models import Chat
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import analytics, chat_events, chat_outbox, views
+from .doctor_stats import consultation_counts, doctor_stats
+from .image_batcher import MicroBatcher
+from .image_jobs import claim_next_job, requeue_stale_jobs, run_scan_job, submit_scan_job
+from .imaging import ImageIngestError, ingest_image, skin_image_metrics
+from .middleware import ProfileMiddleware
+from .model_artifacts import export_bundle
+from . import model_registry
+from .model_registry import SYMPTOM_MODEL_PATH
+from .models import consultation, disease_daily_stats, diseaseinfo, doctor, image_scan_job, patient, rating_review
+from .nb_inference import NaiveBayesEngine
+from .views import NO_KNOWN_SYMPTOMS
+from .prediction import predict_batch, predict_top_k, top_k_diseases
+from .ratings import recompute_doctor_ratings, submit_rating
+from .symptoms import SYMPTOM_INDEX, SYMPTOMS, encode_symptom_sets, encode_symptoms
+
+
+class NaiveBayesEngineTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.model = jb.load(SYMPTOM_MODEL_PATH)
+        rng = np.random.default_rng(0)
+        # Every single symptom, no symptom at all, and random combinations
+        cls.inputs = np.vstack([
+            np.eye(len(SYMPTOMS)),
+            np.zeros((1, len(SYMPTOMS))),
+            (rng.random((200, len(SYMPTOMS))) < 0.05).astype(np.float64),
+        ])
+
+    def assertMatchesModel(self, engine):
+        np.testing.assert_allclose(engine.predict_proba(self.inputs), self.model.predict_proba(self.inputs), rtol=1e-9, atol=1e-12)
+        np.testing.assert_array_equal(engine.predict(self.inputs), self.model.predict(self.inputs))
+
+    def test_engine_from_estimator_matches_sklearn(self):
+        self.assertMatchesModel(NaiveBayesEngine.from_estimator(self.model))
+
+    def test_engine_from_bundle_matches_sklearn(self):
+        with tempfile.TemporaryDirectory() as path:
+            export_bundle(self.model, path, SYMPTOMS)
+            engine = NaiveBayesEngine.from_bundle(path)
+            self.assertIsInstance(engine.feature_log_prob_, np.memmap)
+            self.assertMatchesModel(engine)
+            del engine
+
+    def test_bundle_with_other_features_is_rejected(self):
+        features = list(SYMPTOMS)
+        features[0], features[1] = features[1], features[0]
+        with tempfile.TemporaryDirectory() as path:
+            export_bundle(self.model, path, features)
+            with self.assertRaises(ValueError):
+                NaiveBayesEngine.from_bundle(path, features=SYMPTOMS)
+
+            # The registry falls back to the pickle instead of serving it
+            with mock.patch.object(model_registry, 'SYMPTOM_MODEL_BUNDLE', path):
+                engine = model_registry._load_symptom_model()
+            self.assertNotIsInstance(engine.feature_log_prob_, np.memmap)
+            self.assertMatchesModel(engine)
+
+    def test_rejects_wrong_feature_count(self):
+        engine = NaiveBayesEngine.from_estimator(self.model)
+        with self.assertRaises(ValueError):
+            engine.predict_proba(np.zeros((1, len(SYMPTOMS) - 1)))
+
+
+class SymptomEncodingTests(SimpleTestCase):
+
+    def test_unknown_symptoms_are_reported_not_encoded(self):
+        row, unknown = encode_symptoms(['itching', 'not a symptom', 'skin_rash', 'also unknown'])
+        self.assertEqual(row.shape, (1, len(SYMPTOMS)))
+        self.assertEqual(unknown, ['not a symptom', 'also unknown'])
+        self.assertEqual(sorted(np.flatnonzero(row[0])), [SYMPTOMS.index('itching'), SYMPTOMS.index('skin_rash')])
+
+    def test_only_unknown_symptoms_give_an_empty_row(self):
+        row, unknown = encode_symptoms(['not a symptom'])
+        self.assertFalse(row.any())
+        self.assertEqual(unknown, ['not a symptom'])
+
+    def test_duplicate_column_name_sets_every_column(self):
+        columns = SYMPTOM_INDEX['fluid_overload']
+        self.assertEqual(len(columns), 2)
+        row, _ = encode_symptoms(['fluid_overload'])
+        self.assertEqual(list(np.flatnonzero(row[0])), list(columns))
+
+    def test_sets_match_single_rows(self):
+        sets = [SYMPTOMS[:3], ['not a symptom'], [], ['fluid_overload', 'itching']]
+        matrix, unknown = encode_symptom_sets(sets)
+        self.assertEqual(matrix.shape, (len(sets), len(SYMPTOMS)))
+        for i, symptoms in enumerate(sets):
+            row, row_unknown = encode_symptoms(symptoms)
+            np.testing.assert_array_equal(matrix[i], row[0])
+            self.assertEqual(unknown[i], row_unknown)
+
+
+class TopKDiseaseTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.model = jb.load(SYMPTOM_MODEL_PATH)
+
+    def test_ranked_most_likely_first(self):
+        row, _ = encode_symptoms(SYMPTOMS[:4])
+        ranked = predict_top_k(self.model, row, 3)
+        proba = np.sort(self.model.predict_proba(row)[0])[::-1]
+
+        self.assertEqual(len(ranked), 3)
+        labels, confidences = predict_batch(self.model, row)
+        self.assertEqual(ranked[0]['disease'], labels[0])
+        self.assertAlmostEqual(ranked[0]['confidence'], confidences[0])
+        np.testing.assert_allclose([r['confidence'] for r in ranked], proba[:3] * 100)
+
+    def test_k_is_clamped(self):
+        proba = np.full(len(self.model.classes_), 1 / len(self.model.classes_))
+        self.assertEqual(len(top_k_diseases(self.model, proba, 0)), 1)
+        self.assertEqual(len(top_k_diseases(self.model, proba, 1000)), len(self.model.classes_))
+
+
+# Tests that touch the cache get their own, not the file cache of the checkout
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def make_patient(username):
+    user = User.objects.create_user(username, f'{username}@example.com', 'secret')
+    return patient.objects.create(user=user, name=username, dob=date(1990, 1, 1), address='a', mobile_no='1', gender='Male')
+
+
+def make_doctor(username):
+    user = User.objects.create_user(username, f'{username}@example.com', 'secret')
+    return doctor.objects.create(
+        user=user, name=username, dob=date(1970, 1, 1), address='a', mobile_no='1', gender='Male',
+        registration_no='r', year_of_registration=date(2000, 1, 1), qualification='MD',
+        State_Medical_Council='s', specialization='Dermatologist',
+    )
+
+
+def login(client, profile, session_key):
+    """Log `profile` in the way accounts.views.login does."""
+    client.force_login(profile.user)
+    session = client.session
+    session[session_key] = profile.user.username
+    session.save()
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class HistoryQueryCountTests(TestCase):
+    """History pages cost the same number of queries however long the history is."""
+
+    PAGE_SIZE = 5
+
+    def setUp(self):
+        self.doctor = make_doctor('drhouse')
+        self.patient = make_patient('patient1')
+
+    def add_consultations(self, n):
+        for _ in range(n):
+            # A different patient and doctor each time, so nothing is served
+            # from an already loaded row
+            patient_obj = make_patient(f'p{patient.objects.count()}')
+            doctor_obj = make_doctor(f'd{doctor.objects.count()}')
+            info = diseaseinfo.objects.create(
+                patient=self.patient, diseasename='Acne', no_of_symp=1, symptomsname=['itching'],
+                confidence=90, consultdoctor='Dermatologist',
+            )
+            consultation.objects.create(patient=self.patient, doctor=doctor_obj, diseaseinfo=None, consultation_date=date.today(), status='active')
+            consultation.objects.create(patient=patient_obj, doctor=self.doctor, diseaseinfo=info, consultation_date=date.today(), status='active')
+            rating_review.objects.create(patient=patient_obj, doctor=self.doctor, rating=4, review='ok')
+
+    def assertConstantQueries(self, url):
+        """Render `url` with a short and a long history; both must run the same queries."""
+        self.add_consultations(1)
+        # Each request clears the query log the capture counts from
+        reset_queries()
+        with CaptureQueriesContext(connection) as short:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        short_queries = len(short)
+
+        self.add_consultations(self.PAGE_SIZE * 2)
+        reset_queries()
+        with self.assertNumQueries(short_queries):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(response.context['older_cursor'])
+        return response
+
+    def test_patient_history(self):
+        login(self.client, self.patient, 'patientusername')
+        with mock.patch('main_app.views.CONSULTATION_PAGE_SIZE', self.PAGE_SIZE):
+            response = self.assertConstantQueries(reverse('pconsultation_history'))
+        self.assertEqual(len(response.context['consultation']), self.PAGE_SIZE)
+
+    def test_doctor_history(self):
+        login(self.client, self.doctor, 'doctorusername')
+        with mock.patch('main_app.views.CONSULTATION_PAGE_SIZE', self.PAGE_SIZE):
+            response = self.assertConstantQueries(reverse('dconsultation_history'))
+        self.assertEqual(len(response.context['consultation']), self.PAGE_SIZE)
+
+    def test_doctor_profile_reviews(self):
+        login(self.client, self.patient, 'patientusername')
+        with mock.patch('main_app.views.REVIEW_PAGE_SIZE', self.PAGE_SIZE):
+            response = self.assertConstantQueries(reverse('dviewprofile', args=[self.doctor.user.username]))
+        self.assertEqual(len(response.context['rate']), self.PAGE_SIZE)
+
+    def test_pages_cover_history_once(self):
+        self.add_consultations(12)
+        login(self.client, self.doctor, 'doctorusername')
+        seen, before = [], None
+        with mock.patch('main_app.views.CONSULTATION_PAGE_SIZE', self.PAGE_SIZE):
+            while True:
+                response = self.client.get(reverse('dconsultation_history'), {'before': before} if before else {})
+                seen.extend(c.id for c in response.context['consultation'])
+                before = response.context['older_cursor']
+                if before is None:
+                    break
+        expected = list(consultation.objects.filter(doctor=self.doctor).order_by('-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class CheckDiseaseBatchTests(TestCase):
+
+    def setUp(self):
+        self.patient = make_patient('patient1')
+        self.victim = make_patient('victim')
+
+    def post_batch(self, symptom_sets):
+        return self.client.post(
+            reverse('checkdisease_batch'), json.dumps({'symptom_sets': symptom_sets}), content_type='application/json',
+        )
+
+    def test_predicts_every_set_for_the_session_patient(self):
+        login(self.client, self.patient, 'patientusername')
+        response = self.post_batch([SYMPTOMS[:3], {'symptoms': SYMPTOMS[3:5]}, ['not a symptom']])
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[2], {'error': NO_KNOWN_SYMPTOMS, 'predicteddisease': 'none', 'confidencescore': 0,
+                                      'unknownsymptoms': ['not a symptom']})
+        rows = diseaseinfo.objects.filter(id__in=[r['diseaseinfo_id'] for r in results[:2]])
+        self.assertEqual([row.patient_id for row in rows], [self.patient.pk] * 2)
+
+    def test_patient_cannot_save_for_another_patient(self):
+        login(self.client, self.patient, 'patientusername')
+        response = self.post_batch([{'symptoms': SYMPTOMS[:3], 'patientusername': 'victim'}])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(diseaseinfo.objects.filter(patient=self.victim).exists())
+        self.assertTrue(diseaseinfo.objects.filter(patient=self.patient).exists())
+
+    def test_doctor_may_save_for_a_patient(self):
+        login(self.client, make_doctor('drhouse'), 'doctorusername')
+        response = self.post_batch([{'symptoms': SYMPTOMS[:3], 'patientusername': 'victim'}])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(diseaseinfo.objects.filter(patient=self.victim).exists())
+
+    def test_rejects_missing_or_unknown_patient(self):
+        drhouse = make_doctor('drhouse')
+        login(self.client, drhouse, 'doctorusername')
+        for items in [[SYMPTOMS[:3]],
+                      [{'symptoms': SYMPTOMS[:3]}],
+                      [{'symptoms': SYMPTOMS[:3], 'patientusername': 'victim'},
+                       {'symptoms': SYMPTOMS[:3], 'patientusername': 'nobody'}],
+                      [{'symptoms': SYMPTOMS[:3], 'patientusername': drhouse.user.username}]]:
+            with self.subTest(items=items):
+                response = self.post_batch(items)
+                self.assertEqual(response.status_code, 400)
+        self.assertFalse(diseaseinfo.objects.exists())
+
+    def test_rejects_malformed_items(self):
+        login(self.client, self.patient, 'patientusername')
+        for item in ['itching', 7, None, {'symptoms': None}, {'symptoms': 'itching'}, {}, [1, 2],
+                     {'symptoms': ['itching'], 'patientusername': 3}]:
+            with self.subTest(item=item):
+                response = self.post_batch([SYMPTOMS[:2], item])
+                self.assertEqual(response.status_code, 400)
+        self.assertFalse(diseaseinfo.objects.exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class CheckDiseaseTests(TestCase):
+
+    def setUp(self):
+        self.patient = make_patient('patient1')
+        login(self.client, self.patient, 'patientusername')
+
+    def post_symptoms(self, symptoms):
+        return self.client.post(reverse('checkdisease'), {'noofsym': len(symptoms), 'symptoms[]': symptoms})
+
+    def test_predicts_and_saves(self):
+        response = self.post_symptoms(SYMPTOMS[:3] + ['not a symptom'])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['unknownsymptoms'], ['not a symptom'])
+        self.assertEqual(diseaseinfo.objects.get().patient, self.patient)
+
+    def test_only_unknown_symptoms_are_not_predicted(self):
+        response = self.post_symptoms(['not a symptom', 'neither is this'])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], NO_KNOWN_SYMPTOMS)
+        self.assertEqual(response.json()['predicteddisease'], 'none')
+        self.assertFalse(diseaseinfo.objects.exists())
+        self.assertNotIn('diseaseinfo_id', self.client.session)
+
+
+class MicroBatcherTests(SimpleTestCase):
+
+    def setUp(self):
+        self.batches = []
+
+    def predict(self, batch):
+        self.batches.append(len(batch))
+        return batch * 2
+
+    def test_groups_concurrent_requests(self):
+        batcher = MicroBatcher(self.predict, max_batch_size=4, max_wait=5)
+        futures = [batcher.submit(np.full(3, i, dtype=np.float64)) for i in range(4)]
+
+        # A full batch is run without waiting out max_wait
+        results = [future.result(timeout=2) for future in futures]
+        self.assertEqual(self.batches, [4])
+        for i, result in enumerate(results):
+            np.testing.assert_array_equal(result, np.full(3, 2 * i))
+
+    def test_partial_batch_runs_after_max_wait(self):
+        batcher = MicroBatcher(self.predict, max_batch_size=16, max_wait=0.05)
+        started = time.monotonic()
+        results = [future.result(timeout=2) for future in [batcher.submit(np.ones(2)), batcher.submit(np.ones(2))]]
+
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+        self.assertEqual(self.batches, [2])
+        np.testing.assert_array_equal(results[1], [2, 2])
+
+    def test_exception_reaches_every_caller(self):
+        def fail(batch):
+            raise RuntimeError('model exploded')
+
+        batcher = MicroBatcher(fail, max_batch_size=3, max_wait=5)
+        errors = []
+
+        def call():
+            try:
+                batcher.predict(np.zeros(2), timeout=2)
+            except RuntimeError as e:
+                errors.append(str(e))
+
+        threads = [threading.Thread(target=call) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, ['model exploded'] * 3)
+
+        # The worker thread survives a failed batch
+        batcher._predict = self.predict
+        batcher.max_wait = 0.01
+        np.testing.assert_array_equal(batcher.predict(np.ones(2), timeout=2), [2, 2])
+
+    def test_no_batcher_for_single_threaded_workers(self):
+        image_model = mock.Mock()
+        with mock.patch.object(model_registry, 'get_image_model', return_value=(image_model, ['Acne'])):
+            with mock.patch.dict('os.environ', {'GUNICORN_THREADS': '1'}):
+                self.assertIsNone(model_registry._load_image_batcher())
+            with mock.patch.dict('os.environ', {'GUNICORN_THREADS': '8'}):
+                self.assertIsInstance(model_registry._load_image_batcher(), MicroBatcher)
+
+
+class SkinImageMetricsTests(SimpleTestCase):
+
+    def test_statistics_match_float64_numpy(self):
+        rng = np.random.default_rng(0)
+        for thumbnail in [rng.integers(0, 256, (64, 64, 3), dtype=np.uint8),
+                          np.full((64, 64, 3), 255, dtype=np.uint8),
+                          rng.integers(200, 256, (64, 64, 3), dtype=np.uint8)]:
+            reference = thumbnail.astype(np.float64)
+            metrics = skin_image_metrics(thumbnail)
+            self.assertAlmostEqual(metrics['avg_brightness'], reference.mean(), places=9)
+            self.assertAlmostEqual(metrics['color_variance'], reference.var(), places=6)
+            self.assertAlmostEqual(metrics['brightness_std'], reference.std(), places=6)
+
+
+def image_upload(name='skin.png', format='PNG', size=(32, 32), color=(200, 120, 100)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, format=format)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type=f'image/{format.lower()}')
+
+
+class ImageScanJobTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media_root = media.name
+        settings_override = override_settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.patient = make_patient('patient1')
+
+    def stored_files(self):
+        return [name for _, _, names in os.walk(self.media_root) for name in names]
+
+    def test_rejects_uploads_before_storing_them(self):
+        uploads = [
+            SimpleUploadedFile('notes.png', b'not an image at all'),
+            image_upload('skin.gif', format='GIF'),
+        ]
+        for upload in uploads:
+            with self.subTest(upload=upload.name), self.assertRaises(ImageIngestError):
+                submit_scan_job(self.patient, upload)
+        with mock.patch('main_app.image_jobs.MAX_UPLOAD_PIXELS', 100):
+            with self.assertRaises(ImageIngestError):
+                submit_scan_job(self.patient, image_upload(size=(20, 20)))
+
+        self.assertFalse(image_scan_job.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+    def test_failed_job_deletes_its_upload(self):
+        job = submit_scan_job(self.patient, image_upload())
+        self.assertEqual(len(self.stored_files()), 1)
+
+        with mock.patch('main_app.image_jobs.classify_skin_image', side_effect=ImageIngestError('Invalid image file')):
+            run_scan_job(job.pk)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(self.stored_files(), [])
+
+    def test_stale_running_jobs_are_requeued(self):
+        stale = submit_scan_job(self.patient, image_upload())
+        fresh = submit_scan_job(self.patient, image_upload())
+        an_hour_ago = timezone.now() - timedelta(hours=1)
+        image_scan_job.objects.filter(pk__in=[stale.pk, fresh.pk]).update(status='running', created=an_hour_ago)
+        image_scan_job.objects.filter(pk=stale.pk).update(started=an_hour_ago)
+        # Queued for an hour, but only just claimed
+        image_scan_job.objects.filter(pk=fresh.pk).update(started=timezone.now())
+
+        self.assertEqual(requeue_stale_jobs(), 1)
+        self.assertEqual(image_scan_job.objects.get(pk=stale.pk).status, 'queued')
+        self.assertEqual(image_scan_job.objects.get(pk=fresh.pk).status, 'running')
+
+    def test_claim_sets_started(self):
+        job = submit_scan_job(self.patient, image_upload())
+        image_scan_job.objects.filter(pk=job.pk).update(created=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(claim_next_job(), job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'running')
+        self.assertGreater(job.started, timezone.now() - timedelta(minutes=1))
+        # Long queued but just claimed: not stale
+        self.assertEqual(requeue_stale_jobs(), 0)
+
+    def test_scan_in_request_accepts_any_decodable_format(self):
+        for format in ['GIF', 'BMP', 'TIFF', 'PNG']:
+            with self.subTest(format=format):
+                ingested = ingest_image(image_upload(f'skin.{format.lower()}', format=format))
+                self.assertEqual(ingested.size, (32, 32))
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ChatStateTests(TestCase):
+
+    def setUp(self):
+        self.patient = make_patient('patient1')
+        self.doctor = make_doctor('drhouse')
+        self.consultation = consultation.objects.create(
+            patient=self.patient, doctor=self.doctor, consultation_date=date.today(), status='active',
+        )
+
+    def post(self, message):
+        chat = Chat.objects.create(consultation_id=self.consultation, sender=self.patient.user, message=message)
+        chat_events.chat_posted(chat)
+        return chat
+
+    def test_post_updates_state(self):
+        self.assertEqual(chat_events.chat_state(self.consultation.id), (0, 0))
+        first = self.post('hello')
+        second = self.post('anyone there?')
+        self.assertEqual(chat_events.chat_state(self.consultation.id), (second.id, 2))
+        self.assertGreater(second.id, first.id)
+
+    def test_state_counted_before_a_post_is_not_kept(self):
+        chat_events.chat_state(self.consultation.id)
+        count = chat_events._count_chat_state
+
+        def count_then_post(consultation_id):
+            state = count(consultation_id)
+            # Another request posts between the count and the cache write
+            self.post('racing')
+            return state
+
+        with mock.patch.object(chat_events, '_count_chat_state', side_effect=count_then_post):
+            self.post('first')
+            self.assertEqual(chat_events.chat_state(self.consultation.id)[1], 1)
+
+        last = Chat.objects.latest('id')
+        self.assertEqual(chat_events.chat_state(self.consultation.id), (last.id, 2))
+
+    def test_unchanged_chat_is_answered_with_304(self):
+        login(self.client, self.patient, 'patientusername')
+        session = self.client.session
+        session['consultation_id'] = self.consultation.id
+        session.save()
+        self.post('hello')
+
+        etag = self.client.get(reverse('chat_messages'))['ETag']
+        self.assertEqual(self.client.get(reverse('chat_messages'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.post('again')
+        response = self.client.get(reverse('chat_messages'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_history_rejects_invalid_cursors(self):
+        login(self.client, self.patient, 'patientusername')
+        session = self.client.session
+        session['consultation_id'] = self.consultation.id
+        session.save()
+        chats = [self.post(f'message {i}') for i in range(3)]
+
+        for cursor in ['garbage', '1-2-3', '99999999999999999999999-1', '5-99999999999999999999999', '5-0']:
+            with self.subTest(cursor=cursor):
+                response = self.client.get(reverse('chat_history'), {'before': cursor})
+                self.assertEqual(response.status_code, 400)
+
+        response = self.client.get(reverse('chat_history'), {'before': f'{10 ** 17}-{chats[-1].id}'})
+        self.assertEqual([m['id'] for m in response.json()['messages']], [c.id for c in chats])
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ChatMessagesSinceTests(TestCase):
+
+    def setUp(self):
+        self.patient = make_patient('patient1')
+        self.consultation = consultation.objects.create(
+            patient=self.patient, doctor=make_doctor('drhouse'), consultation_date=date.today(), status='active',
+        )
+        login(self.client, self.patient, 'patientusername')
+        session = self.client.session
+        session['consultation_id'] = self.consultation.id
+        session.save()
+
+    def post(self, message):
+        chat = Chat.objects.create(consultation_id=self.consultation, sender=self.patient.user, message=message)
+        chat_events.chat_posted(chat)
+        return chat
+
+    def since(self, since):
+        return self.client.get(reverse('chat_messages'), {'since': since})
+
+    def test_returns_only_newer_messages(self):
+        first, second, third = self.post('one'), self.post('two'), self.post('three')
+
+        data = self.since(first.id).json()
+        self.assertEqual([m['message'] for m in data['messages']], ['two', 'three'])
+        self.assertEqual([m['id'] for m in data['messages']], [second.id, third.id])
+        self.assertEqual(data['last_id'], third.id)
+
+        self.assertEqual(self.since(0).json()['last_id'], third.id)
+
+    def test_up_to_date_poll_is_answered_from_the_chat_state(self):
+        last = self.post('one')
+        self.assertEqual(self.since(last.id).json(), {'messages': [], 'last_id': last.id})
+
+        with mock.patch('main_app.chat_events._count_chat_state') as count, \
+                mock.patch('main_app.views._chat_events_after') as events_after:
+            self.assertEqual(self.since(last.id).json(), {'messages': [], 'last_id': last.id})
+        count.assert_not_called()
+        events_after.assert_not_called()
+
+    def test_new_post_is_seen_by_the_next_poll(self):
+        last = self.post('one')
+        self.since(last.id)  # caches the state
+        newer = self.post('two')
+        data = self.since(last.id).json()
+        self.assertEqual([m['id'] for m in data['messages']], [newer.id])
+
+    def test_rejects_bad_requests(self):
+        self.assertEqual(self.since('abc').status_code, 400)
+        session = self.client.session
+        del session['consultation_id']
+        session.save()
+        self.assertEqual(self.since(0).status_code, 400)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class DoctorStatsTests(TestCase):
+
+    def setUp(self):
+        self.doctor = make_doctor('drhouse')
+        self.patient = make_patient('patient1')
+
+    def consult(self, status='active'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return consultation.objects.create(
+                patient=self.patient, doctor=self.doctor, consultation_date=date.today(), status=status,
+            )
+
+    def counts(self):
+        return consultation_counts(self.doctor.pk)
+
+    def test_counts_are_cached(self):
+        self.consult()
+        self.consult('closed')
+        self.assertEqual(self.counts(), {'total': 2, 'active': 1, 'closed': 1})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.counts(), {'total': 2, 'active': 1, 'closed': 1})
+
+    def test_new_consultation_drops_the_counts(self):
+        self.consult()
+        self.assertEqual(self.counts()['total'], 1)
+        self.consult()
+        self.assertEqual(self.counts(), {'total': 2, 'active': 2, 'closed': 0})
+
+    def test_closing_drops_the_counts(self):
+        active = self.consult()
+        self.assertEqual(self.counts()['active'], 1)
+
+        login(self.client, self.doctor, 'doctorusername')
+        response = self.client.post(reverse('close_consultation', args=[active.pk]))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.counts(), {'total': 1, 'active': 0, 'closed': 1})
+
+    def test_deleting_drops_the_counts(self):
+        doomed = self.consult()
+        self.assertEqual(self.counts()['total'], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            doomed.delete()
+        self.assertEqual(self.counts()['total'], 0)
+
+    def test_other_doctors_keep_their_counts(self):
+        self.consult()
+        self.counts()
+        other = make_doctor('drwho')
+        with self.captureOnCommitCallbacks(execute=True):
+            consultation.objects.create(patient=self.patient, doctor=other, consultation_date=date.today(), status='active')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.counts()['total'], 1)
+
+    def test_doctor_stats(self):
+        self.assertEqual(doctor_stats(self.doctor)['performance_score'], 3)
+        for _ in range(5):
+            self.consult()
+        stats = doctor_stats(self.doctor)
+        self.assertEqual(stats['total_consultations'], 5)
+        self.assertEqual(stats['active_consultations'], 5)
+        self.assertEqual(stats['completed_consultations'], 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ChatStreamTests(TestCase):
+
+    def setUp(self):
+        self.patient = make_patient('patient1')
+        self.consultation = consultation.objects.create(
+            patient=self.patient, doctor=make_doctor('drhouse'), consultation_date=date.today(), status='active',
+        )
+        login(self.client, self.patient, 'patientusername')
+        session = self.client.session
+        session['consultation_id'] = self.consultation.id
+        session.save()
+
+    def open_stream(self):
+        response = self.client.get(reverse('chat_stream'))
+        if response.streaming:
+            # The server closes the response when the client goes away
+            self.addCleanup(response.close)
+        return response
+
+    def test_posts_get_through_while_streams_are_open(self):
+        with mock.patch('main_app.views.CHAT_STREAM_MAX_PER_WORKER', 2), \
+                mock.patch('main_app.views.CHAT_ASYNC_WRITES', False):
+            streams = [self.open_stream() for _ in range(2)]
+            self.assertEqual([r.status_code for r in streams], [200, 200])
+
+            # A third page is turned away instead of taking another thread...
+            refused = self.open_stream()
+            self.assertEqual(refused.status_code, 503)
+            self.assertEqual(refused['Retry-After'], str(views.CHAT_STREAM_TIMEOUT))
+
+            # ...so posting still finds one
+            response = self.client.post(reverse('post'), {'msgbox': 'still there?'})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(Chat.objects.filter(message='still there?').exists())
+
+            streams[0].close()
+            self.assertEqual(self.open_stream().status_code, 200)
+
+    def test_default_limit_leaves_half_the_threads(self):
+        for threads, limit in [('8', 4), ('3', 1), ('1', 0)]:
+            with mock.patch.dict('os.environ', {'GUNICORN_THREADS': threads}):
+                self.assertEqual(views._max_chat_streams(), limit)
+        with mock.patch.dict('os.environ'):
+            os.environ.pop('GUNICORN_THREADS', None)
+            self.assertIsNone(views._max_chat_streams())
+
+    def test_recheck_queries_only_after_a_post_elsewhere(self):
+        chat_events.chat_state(self.consultation.id)  # starts the version
+        with mock.patch('main_app.views.CHAT_STREAM_RECHECK', 0.01):
+            stream = views._chat_stream(self.consultation.id, 0)
+            self.addCleanup(stream.close)
+            self.assertEqual(next(stream), 'retry: 3000\n\n')
+            self.assertEqual(next(stream), ': keepalive\n\n')
+            with self.assertNumQueries(0):
+                self.assertEqual(next(stream), ': keepalive\n\n')
+
+            # Posted through another worker: the version moves, nothing is published here
+            chat = Chat.objects.create(consultation_id=self.consultation, sender=self.patient.user, message='hi')
+            cache.incr(chat_events._version_key(self.consultation.id))
+            self.assertIn(f'id: {chat.id}\n', next(stream))
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ChatOutboxTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'outbox', 'chat_outbox.sqlite3')
+        for patcher in [mock.patch.object(chat_outbox, 'CHAT_OUTBOX_PATH', self.path),
+                        # The flusher thread would not see this test's uncommitted rows
+                        mock.patch.object(chat_outbox, 'get_flusher')]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(self.restart)
+
+        self.patient = make_patient('patient1')
+        self.doctor = make_doctor('drhouse')
+        self.consultations = [
+            consultation.objects.create(patient=self.patient, doctor=self.doctor, consultation_date=date.today(), status='active')
+            for _ in range(2)
+        ]
+
+    def restart(self):
+        # What a new process sees: no open connection, only the file
+        conn = getattr(chat_outbox._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            del chat_outbox._local.conn
+
+    def enqueue(self, consultation_obj, message, sender=None):
+        return chat_outbox.enqueue(consultation_obj.id, (sender or self.patient.user).id, message)
+
+    def test_flush_keeps_order_and_send_time(self):
+        sent = datetime(2026, 1, 2, 3, 4, 5, tzinfo=dt_timezone.utc)
+        with mock.patch('main_app.chat_outbox.timezone.now', return_value=sent):
+            keys = [self.enqueue(self.consultations[i % 2], f'message {i}') for i in range(5)]
+
+        self.assertEqual(chat_outbox.flush_all(), 5)
+        chats = list(Chat.objects.order_by('id'))
+        self.assertEqual([str(c.outbox_key) for c in chats], keys)
+        self.assertEqual([c.message for c in chats], [f'message {i}' for i in range(5)])
+        self.assertEqual({c.created for c in chats}, {sent})
+        self.assertEqual(chat_outbox.pending(), 0)
+
+    def test_replayed_batch_is_not_inserted_twice(self):
+        for i in range(3):
+            self.enqueue(self.consultations[0], f'message {i}')
+        rows = chat_outbox._connect().execute(
+            'SELECT key, consultation_id, sender_id, message, created FROM chat_outbox ORDER BY seq'
+        ).fetchall()
+        chat_outbox.flush_all()
+
+        # A crash after the database commit but before the outbox delete
+        chat_outbox._connect().executemany(
+            'INSERT INTO chat_outbox (key, consultation_id, sender_id, message, created) VALUES (?, ?, ?, ?, ?)', rows,
+        )
+        self.assertEqual(chat_outbox.flush_all(), 3)
+        self.assertEqual(Chat.objects.count(), 3)
+        self.assertEqual(chat_outbox.pending(), 0)
+
+    def test_messages_of_deleted_consultations_or_users_are_dropped(self):
+        self.enqueue(self.consultations[0], 'kept')
+        chat_outbox.enqueue(999999, self.patient.user.id, 'no consultation')
+        chat_outbox.enqueue(self.consultations[0].id, 999999, 'no sender')
+
+        self.assertEqual(chat_outbox.flush_all(), 3)
+        self.assertEqual(list(Chat.objects.values_list('message', flat=True)), ['kept'])
+        self.assertEqual(chat_outbox.pending(), 0)
+
+    def test_worker_start_drains_what_a_previous_process_left(self):
+        chat_outbox.resume()
+        chat_outbox.get_flusher.return_value.wake.assert_not_called()
+
+        self.enqueue(self.consultations[0], 'before the restart')
+        chat_outbox.get_flusher.reset_mock()
+        self.restart()
+
+        chat_outbox.resume()
+        chat_outbox.get_flusher.return_value.wake.assert_called_once_with()
+        self.assertEqual(chat_outbox.flush_all(), 1)
+        self.assertEqual(Chat.objects.get().message, 'before the restart')
+
+    def test_outbox_written_before_the_created_column(self):
+        os.makedirs(os.path.dirname(self.path))
+        with sqlite3.connect(self.path) as conn:
+            conn.execute(chat_outbox._SCHEMA.replace(',\n    created TEXT', ''))
+            conn.execute(
+                'INSERT INTO chat_outbox (key, consultation_id, sender_id, message) VALUES (?, ?, ?, ?)',
+                ('6f1c1c7e-4b0c-4a36-9d2e-0d8f5d0c6a11', self.consultations[0].id, self.patient.user.id, 'old'),
+            )
+        conn.close()
+
+        self.assertEqual(chat_outbox.flush_all(), 1)
+        self.assertEqual(Chat.objects.get().message, 'old')
+
+
+class ProfileMiddlewareTests(TestCase):
+
+    def setUp(self):
+        self.patient = make_patient('patient1')
+        login(self.client, self.patient, 'patientusername')
+
+    def request_user(self):
+        return self.client.get(reverse('home')).wsgi_request.user
+
+    def test_user_is_loaded_with_its_profile(self):
+        user = self.request_user()
+        self.assertEqual(user, self.patient.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(user.patient.name, 'patient1')
+
+    def test_password_change_ends_the_session(self):
+        self.assertTrue(self.request_user().is_authenticated)
+        # A queryset update sends no signal and must still take effect at once
+        new_password = User(username='x')
+        new_password.set_password('changed')
+        User.objects.filter(pk=self.patient.pk).update(password=new_password.password)
+        self.assertFalse(self.request_user().is_authenticated)
+
+    def test_deactivation_ends_the_session(self):
+        self.assertTrue(self.request_user().is_authenticated)
+        User.objects.filter(pk=self.patient.pk).update(is_active=False)
+        self.assertFalse(self.request_user().is_authenticated)
+
+    def test_logout_ends_the_session(self):
+        self.assertTrue(self.request_user().is_authenticated)
+        self.client.get(reverse('logout'))
+        self.assertFalse(self.request_user().is_authenticated)
+
+    def session_request(self):
+        request = RequestFactory().get('/')
+        request.session = self.client.session
+        request.session.items()  # loads it, as SessionMiddleware would
+        return request
+
+    def process(self, view, request=None):
+        request = request or self.session_request()
+        AuthenticationMiddleware(view).process_request(request)
+        return ProfileMiddleware(view)(request)
+
+    def test_nothing_is_loaded_unless_used(self):
+        request = self.session_request()
+        with self.assertNumQueries(0):
+            self.process(lambda request: HttpResponse(), request)
+
+    def test_profile_is_loaded_with_the_user(self):
+        def view(request):
+            with self.assertNumQueries(1):
+                self.assertEqual(request.profile, self.patient)
+                self.assertEqual(request.user.patient.name, 'patient1')
+            return HttpResponse()
+        self.process(view)
+
+    def test_profile_is_not_kept_between_requests(self):
+        names = []
+
+        def view(request):
+            names.append(request.profile.name)
+            return HttpResponse()
+
+        self.process(view)
+        patient.objects.filter(pk=self.patient.pk).update(name='renamed')
+        self.process(view)
+        self.assertEqual(names, ['patient1', 'renamed'])
+
+    def test_anonymous_request_has_no_profile(self):
+        self.client.logout()
+
+        def view(request):
+            self.assertFalse(request.user.is_authenticated)
+            self.assertFalse(request.profile)
+            return HttpResponse()
+        self.process(view)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class DiseaseAnalyticsTests(TestCase):
+
+    def setUp(self):
+        self.patient = make_patient('patient1')
+
+    def predict(self, diseasename='Acne', confidence=80, method='symptoms', created_at=None):
+        return diseaseinfo.objects.create(
+            patient=self.patient, diseasename=diseasename, no_of_symp=1, symptomsname=['itching'],
+            confidence=confidence, consultdoctor='Dermatologist', prediction_method=method,
+            created_at=created_at or timezone.now(),
+        )
+
+    def test_created_at_backfill(self):
+        backfill = import_module('main_app.migrations.0010_diseaseinfo_created_at').backfill_created_at
+        doctor_obj = make_doctor('drhouse')
+        consulted, scanned, unknown = self.predict(), self.predict(method='image'), self.predict()
+        consultation.objects.create(patient=self.patient, doctor=doctor_obj, diseaseinfo=consulted,
+                                    consultation_date=date(2020, 3, 4), status='closed')
+        job = image_scan_job.objects.create(patient=self.patient, skin_image='skin_images/a.png', diseaseinfo=scanned,
+                                            status='done')
+        diseaseinfo.objects.update(created_at=None)
+
+        with self.assertNumQueries(1):
+            backfill(django_apps, None)
+
+        for row in (consulted, scanned, unknown):
+            row.refresh_from_db()
+        self.assertEqual(consulted.created_at, datetime(2020, 3, 4, tzinfo=dt_timezone.utc))
+        self.assertEqual(scanned.created_at, job.created)
+        self.assertIsNone(unknown.created_at)
+
+    def test_undated_predictions_count_but_are_not_in_the_time_series(self):
+        self.predict()
+        undated = self.predict('Psoriasis')
+        diseaseinfo.objects.filter(pk=undated.pk).update(created_at=None)
+        analytics.rebuild_disease_daily_stats()
+
+        self.assertEqual(analytics.prediction_method_split()['total'], 2)
+        self.assertEqual(set(analytics.disease_statistics(2)), {'Acne', 'Psoriasis'})
+        self.assertEqual(sum(bucket['count'] for bucket in analytics.prediction_time_series('years', 50)), 1)
+
+        # Deleting the undated prediction takes it out of the totals again
+        undated.refresh_from_db()
+        undated.delete()
+        self.assertEqual(analytics.prediction_method_split()['total'], 1)
+
+    def assertRollupMatchesRebuild(self):
+        def rollup():
+            return sorted(disease_daily_stats.objects.filter(count__gt=0).values_list(
+                'date', 'diseasename', 'prediction_method', 'count', 'confidence_sum'))
+
+        maintained = rollup()
+        analytics.rebuild_disease_daily_stats()
+        self.assertEqual(maintained, rollup())
+        return maintained
+
+    def test_signals_maintain_the_rollup(self):
+        yesterday = timezone.now() - timedelta(days=1)
+        self.predict('Acne', 80)
+        self.predict('Acne', 60)
+        self.predict('Acne', 90, created_at=yesterday)
+        self.predict('Psoriasis', 70, method='image')
+        doomed = self.predict('Impetigo', 50)
+        doomed.delete()
+
+        today = timezone.localdate()
+        self.assertEqual(self.assertRollupMatchesRebuild(), [
+            (today - timedelta(days=1), 'Acne', 'symptoms', 1, 90.0),
+            (today, 'Acne', 'symptoms', 2, 140.0),
+            (today, 'Psoriasis', 'image', 1, 70.0),
+        ])
+
+    def test_rollup_failure_does_not_store_the_prediction(self):
+        with mock.patch('main_app.analytics._upsert', side_effect=RuntimeError('rollup down')):
+            with self.assertRaises(RuntimeError):
+                self.predict()
+        self.assertFalse(diseaseinfo.objects.exists())
+
+        kept = self.predict()
+        with mock.patch('main_app.analytics._upsert', side_effect=RuntimeError('rollup down')):
+            with self.assertRaises(RuntimeError):
+                kept.delete()
+        self.assertTrue(diseaseinfo.objects.filter(pk=kept.pk).exists())
+        self.assertRollupMatchesRebuild()
+
+    def test_batch_predictions_are_rolled_up(self):
+        login(self.client, self.patient, 'patientusername')
+        response = self.client.post(reverse('checkdisease_batch'), json.dumps({'symptom_sets': [SYMPTOMS[:3]] * 3}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(analytics.prediction_method_split(), {'total': 3, 'symptoms': 3, 'image': 0})
+        self.assertRollupMatchesRebuild()
+
+    def test_method_split_and_disease_statistics(self):
+        self.predict('Acne', 80)
+        self.predict('Acne', 60)
+        self.predict('Psoriasis', 90, method='image')
+        self.predict('Impetigo', 30)
+
+        split = analytics.prediction_method_split()
+        self.assertEqual(split, {'total': 4, 'symptoms': 3, 'image': 1})
+        stats = analytics.disease_statistics(split['total'])
+        self.assertEqual(list(stats), ['Acne', 'Impetigo', 'Psoriasis'])
+        self.assertEqual(stats['Acne']['count'], 2)
+        self.assertEqual(stats['Acne']['percentage'], 50)
+        self.assertEqual(stats['Acne']['avg_confidence'], 70)
+        self.assertEqual(stats['Psoriasis']['percentage'], 25)
+
+    def test_time_series_buckets(self):
+        now = timezone.now()
+        self.predict(created_at=now)
+        self.predict(created_at=now)
+        self.predict(created_at=now - timedelta(days=400))
+        self.predict(created_at=now - timedelta(days=5000))
+
+        years = analytics.prediction_time_series('years', 3)
+        this_year = timezone.localdate().year
+        self.assertEqual([bucket['period'] for bucket in years], [date(this_year - i, 1, 1) for i in (2, 1, 0)])
+        self.assertEqual([bucket['label'] for bucket in years], [str(this_year - i) for i in (2, 1, 0)])
+        self.assertEqual(years[-1]['count'], 2)
+        # The prediction from 5000 days ago is older than the window
+        self.assertEqual(sum(bucket['count'] for bucket in years), 3)
+
+        months = analytics.prediction_time_series('months', 6)
+        self.assertEqual(len(months), 6)
+        self.assertEqual(months[-1]['period'], timezone.localdate().replace(day=1))
+        self.assertEqual(months[-1]['count'], 2)
+        self.assertEqual(sum(bucket['count'] for bucket in months), 2)
+
+        weeks = analytics.prediction_time_series('weeks', 4)
+        today = timezone.localdate()
+        self.assertEqual(weeks[-1]['period'], today - timedelta(days=today.weekday()))
+        self.assertEqual([bucket['count'] for bucket in weeks], [0, 0, 0, 2])
+
+
+class FragmentCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache_dir = directory.name
+        settings_override = override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory.name,
+        }})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.calls = []
+
+    def compute(self):
+        self.calls.append(1)
+        time.sleep(0.2)
+        return {'total': len(self.calls)}
+
+    def test_value_is_cached_until_invalidated(self):
+        self.assertEqual(analytics.cached_fragment('split', self.compute), {'total': 1})
+        self.assertEqual(analytics.cached_fragment('split', self.compute), {'total': 1})
+        analytics.invalidate_dashboard_cache()
+        self.assertEqual(analytics.cached_fragment('split', self.compute), {'total': 2})
+
+    def test_concurrent_misses_compute_once(self):
+        barrier = threading.Barrier(8)
+        results = []
+
+        def request():
+            barrier.wait()
+            results.append(analytics.cached_fragment('split', self.compute))
+
+        threads = [threading.Thread(target=request) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(results, [{'total': 1}] * 8)
+        # The lock file is gone once the value is stored
+        self.assertEqual([name for name in os.listdir(self.cache_dir) if name.endswith('.lock')], [])
+
+    def test_file_lock_is_exclusive(self):
+        self.assertTrue(analytics._acquire_lock('analytics:x:lock'))
+        self.assertFalse(analytics._acquire_lock('analytics:x:lock'))
+        analytics._release_lock('analytics:x:lock')
+        self.assertTrue(analytics._acquire_lock('analytics:x:lock'))
+
+    def test_lock_left_by_a_dead_process_expires(self):
+        self.assertTrue(analytics._acquire_lock('analytics:x:lock'))
+        path, = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir) if name.endswith('.lock')]
+        expired = time.time() - analytics.DASHBOARD_CACHE_LOCK_TIMEOUT - 1
+        os.utime(path, (expired, expired))
+        self.assertTrue(analytics._acquire_lock('analytics:x:lock'))
+
+
+class RatingTests(TestCase):
+
+    def setUp(self):
+        self.patient = make_patient('patient1')
+        self.doctor = make_doctor('drhouse')
+        self.consultation = consultation.objects.create(
+            patient=self.patient, doctor=self.doctor, consultation_date=date.today(), status='closed',
+        )
+        login(self.client, self.patient, 'patientusername')
+
+    def rate(self, rating):
+        return self.client.post(reverse('rate_review', args=[self.consultation.pk]), {'rating': rating, 'review': 'ok'})
+
+    def totals(self):
+        self.doctor.refresh_from_db()
+        return self.doctor.rating_sum, self.doctor.rating_count, self.doctor.rating
+
+    def test_ratings_update_the_totals(self):
+        for rating in [4, 5, 2]:
+            self.assertEqual(self.rate(rating).status_code, 302)
+
+        self.assertEqual(self.totals(), (11, 3, 3))
+        self.assertEqual(self.doctor.average_rating, 3.7)
+        # The running totals agree with a recount from the reviews
+        self.assertEqual(recompute_doctor_ratings(), 0)
+
+    def test_out_of_range_ratings_are_rejected(self):
+        self.rate(4)
+        for rating in [0, 6, -3, 1000, 'five', '']:
+            with self.subTest(rating=rating):
+                self.assertEqual(self.rate(rating).status_code, 302)
+        self.assertEqual(self.totals(), (4, 1, 4))
+        self.assertEqual(rating_review.objects.count(), 1)
+
+        with self.assertRaises(ValueError):
+            submit_rating(self.patient, self.doctor, 6, 'too good')
+        self.assertEqual(self.totals(), (4, 1, 4))
+
+    def test_recompute_repairs_drifted_totals(self):
+        self.rate(5)
+        self.rate(3)
+        doctor.objects.filter(pk=self.doctor.pk).update(rating_sum=0, rating_count=0, rating=0)
+
+        self.assertEqual(recompute_doctor_ratings(), 1)
+        self.assertEqual(self.totals(), (8, 2, 4))
+
+
+class QueryPlanTests(TestCase):
+
+    def test_hot_queries_use_indexes(self):
+        out = io.StringIO()
+        call_command('check_query_plans', stdout=out)
+        self.assertIn('doctor consultation history: ok', out.getvalue())
+        self.assertIn('All hot queries use an index', out.getvalue())
+
+    def test_full_scan_fails(self):
+        unindexed = [('chat search', Chat.objects.filter(message='hello'))]
+        with mock.patch('main_app.management.commands.check_query_plans.hot_queries', return_value=unindexed):
+            with self.assertRaises(CommandError):
+                call_command('check_query_plans', stdout=io.StringIO())
@@ -8,7 +8,9 @@ urlpatterns = [
 
     path('patient_ui', views.patient_ui , name='patient_ui'),
     path('checkdisease', views.checkdisease, name="checkdisease"),
+    path('checkdisease_batch', views.checkdisease_batch, name="checkdisease_batch"),
     path('scan_image', views.scan_image, name="scan_image"),
+    path('scan_image_status/<uuid:job_id>', views.scan_image_status, name="scan_image_status"),
     path('disease_analytics_dashboard', views.disease_analytics_dashboard, name="disease_analytics_dashboard"),
     path('pviewprofile/<str:patientusername>', views.pviewprofile , name='pviewprofile'),
     path('pconsultation_history', views.pconsultation_history , name='pconsultation_history'),
@@ -29,6 +31,8 @@ urlpatterns = [
     
     path('post', views.post, name='post'),
     path('chat_messages', views.chat_messages, name='chat_messages'),
+    path('chat_history', views.chat_history, name='chat_history'),
+    path('chat_stream', views.chat_stream, name='chat_stream'),
     
 
 
@@ -1,202 +1,84 @@
 from django.shortcuts import render, redirect
+from django.urls import reverse
 from django.http import HttpResponse
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from datetime import date
-import os
+import datetime
+import threading
 
 from django.contrib import messages
 from django.contrib.auth.models import User , auth
 from django.contrib.auth.decorators import login_required
-from django.db import models
-from .models import patient , doctor , diseaseinfo , consultation ,rating_review
+from django.db import models, transaction
+from django.db.models.functions import Lower
+from django.conf import settings
+from django.utils import timezone
+from .models import patient , doctor , diseaseinfo , consultation ,rating_review, image_scan_job
 from chats.models import Chat,Feedback
+from .symptoms import SYMPTOMS, encode_symptoms, encode_symptom_sets
+from .prediction import consult_doctor_for, predict_batch, predict_top_k
 
 # Create your views here.
 
 
-#loading trained_model
-import joblib as jb
-model = jb.load('trained_model')
-
-# Image processing imports
-import numpy as np
-from PIL import Image
-import io
-import base64
-import json
-import os
-
-def validate_skin_image(img):
-    """
-    Validate if the uploaded image is likely to be a skin disease image
-    Returns: dict with 'is_skin_image' (bool) and 'reason' (str)
-    """
-    try:
-        # Convert to RGB if not already
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        
-        # Resize for analysis (smaller size for faster processing)
-        img_resized = img.resize((64, 64))
-        img_array = np.array(img_resized)
-        
-        # Basic skin detection using color analysis
-        # Human skin typically has specific color ranges
-        r, g, b = img_array[:, :, 0], img_array[:, :, 1], img_array[:, :, 2]
-        
-        # Skin color detection (RGB ranges for human skin)
-        skin_mask = (r > 95) & (g > 40) & (b > 20) & \
-                   (max(r, g, b) - min(r, g, b) > 15) & \
-                   (abs(r - g) > 15) & (r > g) & (r > b)
-        
-        skin_percentage = np.sum(skin_mask) / skin_mask.size
-        
-        # Image dimension validation
-        width, height = img.size
-        aspect_ratio = width / height
-        
-        # Calculate image statistics
-        avg_brightness = np.mean(img_array)
-        brightness_std = np.std(img_array)
-        color_variance = np.var(img_array)
-        
-        # Validation checks
-        issues = []
-        
-        # Check 1: Image too small
-        if width < 100 or height < 100:
-            issues.append("Image is too small. Please upload a clearer, higher resolution image.")
-        
-        # Check 2: Image too large
-        if width > 4000 or height > 4000:
-            issues.append("Image is too large. Please resize to a smaller size.")
-        
-        # Check 3: Extremely skewed aspect ratio (likely not a skin photo)
-        if aspect_ratio > 4 or aspect_ratio < 0.25:
-            issues.append("Image aspect ratio suggests this may not be a skin disease photo.")
-        
-        # Check 4: Very low skin color percentage (likely not skin)
-        if skin_percentage < 0.1:  # Less than 10% skin-like colors
-            issues.append("Image does not appear to contain human skin. Please upload a skin disease image.")
-        
-        # Check 5: Very bright or very dark images (likely not medical photos)
-        if avg_brightness < 30:
-            issues.append("Image is too dark. Please ensure good lighting.")
-        elif avg_brightness > 240:
-            issues.append("Image is too bright/overexposed. Please ensure proper lighting.")
-        
-        # Check 6: Very low color variance (likely solid color or very uniform)
-        if color_variance < 100:
-            issues.append("Image appears too uniform. Please upload a clearer photo with visible skin texture.")
-        
-        # Check 7: Very high color variance (likely noisy or non-skin image)
-        if color_variance > 5000:
-            issues.append("Image appears to have excessive noise or may not be a medical photo.")
-        
-        # Check 8: Check for face-like features (basic heuristic)
-        # This is a simple check - faces typically have more defined patterns
-        if brightness_std > 80 and skin_percentage > 0.3:
-            issues.append("This image may contain a face. Please upload only skin disease/lesion photos.")
-        
-        if issues:
-            return {
-                'is_skin_image': False,
-                'reason': ' '.join(issues)
-            }
-        
-        # Additional validation for medical suitability
-        # Check if image has enough detail for medical analysis
-        if skin_percentage < 0.3:
-            return {
-                'is_skin_image': False,
-                'reason': "Image doesn't contain enough visible skin area for medical analysis."
-            }
-        
-        # If all checks pass, it's likely a valid skin image
-        return {
-            'is_skin_image': True,
-            'reason': 'Valid skin disease image'
-        }
-        
-    except Exception as e:
-        # If analysis fails, return as potentially valid but log the error
-        print(f"Image validation error: {str(e)}")
-        return {
-            'is_skin_image': True,
-            'reason': 'Validation completed with warnings'
-        }
-
-import os, json
-import joblib as jb
-
-_symptom_model = None
-_image_model = None
-_image_labels = None
+# Prediction models are loaded lazily, once per process
+from .model_registry import get_symptom_model, worker_threads
+from .imaging import ImageIngestError, SkinImageRejected, classify_skin_image
+from .analytics import (
+    TIME_RANGES, cached_fragment, disease_statistics, prediction_method_split,
+    prediction_time_series, recent_predictions, record_predictions,
+)
+from .image_jobs import submit_scan_job
+from .chat_events import chat_event, chat_posted, chat_state, chat_version, get_backend, subscribe_consultation
+from . import chat_outbox
+from .ratings import RATING_MAX, RATING_MIN, submit_rating
+from .doctor_stats import doctor_stats, invalidate_doctor_stats
+from .middleware import session_user
 
+# Upper bound on the symptom sets accepted by one checkdisease_batch request
+SYMPTOM_BATCH_MAX_SIZE = getattr(settings, 'SYMPTOM_BATCH_MAX_SIZE', 500)
 
-def get_symptom_model():
-    global _symptom_model
-    if _symptom_model is None:
-        _symptom_model = jb.load(os.path.join('models', 'trained_model'))
-    return _symptom_model
+# Number of ranked diseases checkdisease returns as the differential diagnosis
+DIFFERENTIAL_SIZE = getattr(settings, 'DIFFERENTIAL_SIZE', 3)
 
+# Answer to a symptom set with no symptom the model knows; such a set is not
+# predicted (the model would only echo its class priors) nor saved
+NO_KNOWN_SYMPTOMS = 'None of the given symptoms are known to the model'
 
-def get_image_model():
-    global _image_model, _image_labels
+# Seconds scan_image waits for its micro-batched CNN prediction
+IMAGE_PREDICT_TIMEOUT = getattr(settings, 'IMAGE_PREDICT_TIMEOUT', 30)
 
-    if _image_model is None:
-        from tensorflow import keras
+# Uploads with more pixels than this are rejected before decoding
+MAX_UPLOAD_PIXELS = getattr(settings, 'MAX_UPLOAD_PIXELS', 40000000)
 
-        if not os.path.exists(CNN_MODEL_PATH):
-            return None, None
+# Seconds a chat event stream stays open before the browser reconnects
+CHAT_STREAM_TIMEOUT = getattr(settings, 'CHAT_STREAM_TIMEOUT', 30)
 
-        _image_model = keras.models.load_model(CNN_MODEL_PATH)
+# Seconds between checks for messages posted through other processes, when
+# the event backend only sees messages posted through the same process
+CHAT_STREAM_RECHECK = getattr(settings, 'CHAT_STREAM_RECHECK', 5)
 
-        with open(CNN_LABELS_PATH) as f:
-            _image_labels = json.load(f)
+# Chat streams one worker process holds open at once. Every stream occupies
+# a thread, so by default half of a gunicorn worker's threads are left to
+# ordinary requests (no limit under runserver). Refused streams fall back to
+# polling chat_messages.
+CHAT_STREAM_MAX_PER_WORKER = getattr(settings, 'CHAT_STREAM_MAX_PER_WORKER', None)
 
-    return _image_model, _image_labels
+# Messages per page of chat history; chat_messages renders the latest page
+CHAT_PAGE_SIZE = getattr(settings, 'CHAT_PAGE_SIZE', 50)
 
+# Consultations per page of the patient and doctor consultation histories
+CONSULTATION_PAGE_SIZE = getattr(settings, 'CONSULTATION_PAGE_SIZE', 25)
 
+# Reviews per page of a doctor's profile
+REVIEW_PAGE_SIZE = getattr(settings, 'REVIEW_PAGE_SIZE', 20)
 
+# Acknowledge chat messages once they are in the local outbox and write them
+# to the database in batches (see chat_outbox.py); False saves each one inline
+CHAT_ASYNC_WRITES = getattr(settings, 'CHAT_ASYNC_WRITES', True)
 
-
-# Optional CNN image model (load if available)
-CNN_MODEL_PATH = os.path.join('models', 'skin_cnn.h5')
-CNN_LABELS_PATH = os.path.join('models', 'skin_cnn_labels.json')
-image_model = None
-image_labels = None
-
-if os.path.exists(CNN_MODEL_PATH):
-    try:
-        from tensorflow import keras
-        image_model = keras.models.load_model(CNN_MODEL_PATH)
-        
-        if os.path.exists(CNN_LABELS_PATH):
-            with open(CNN_LABELS_PATH) as f:
-                image_labels = json.load(f)
-            print("Loaded CNN image model for skin disease detection with labels.")
-        else:
-            print(f"Warning: CNN model loaded but labels file not found at {CNN_LABELS_PATH}")
-            # Use default labels
-            image_labels = [
-                "Acne", "Fungal infection", "Psoriasis", "Impetigo", "Chicken pox",
-                "Eczema", "Dermatitis", "Melanoma", "Basal cell carcinoma",
-                "Squamous cell carcinoma", "Rosacea", "Vitiligo", "Hives",
-                "Scabies", "Ringworm", "Seborrheic dermatitis", "Lichen planus",
-                "Melasma", "Keratosis pilaris", "Cold sore"
-            ]
-            print("Using default skin disease labels.")
-    except Exception as e:
-        print(f"Warning: could not load CNN image model: {e}")
-        print("Falling back to basic image analysis.")
-        image_model = None
-        image_labels = None
-else:
-    print(f"CNN model not found at {CNN_MODEL_PATH}")
-
-
-
+import json
+import time
 
 #def home(request):
 
@@ -207,65 +89,57 @@ else:
 
     #  else :
      #   return render(request,'homepage/index.html')
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_http_methods
 
 @login_required(login_url="/sign_in")
 def disease_analytics_dashboard(request):
     """Comprehensive disease analytics dashboard with charts and top diseases"""
     
-    # Get all disease predictions
-    all_predictions = diseaseinfo.objects.all()
-    
-    # Aggregate disease frequencies
-    disease_stats = {}
-    total_predictions = all_predictions.count()
+    # Every block is cached until the next prediction is stored
+    method_split = cached_fragment('method_split', prediction_method_split)
+    total_predictions = method_split['total']
+    symptoms_predictions = method_split['symptoms']
+    image_predictions = method_split['image']
     
-    for prediction in all_predictions:
-        disease_name = prediction.diseasename
-        if disease_name in disease_stats:
-            disease_stats[disease_name]['count'] += 1
-            disease_stats[disease_name]['confidence_sum'] += float(prediction.confidence)
-        else:
-            disease_stats[disease_name] = {
-                'count': 1,
-                'confidence_sum': float(prediction.confidence)
-            }
-    
-    # Calculate percentages and average confidence
-    for disease in disease_stats:
-        disease_stats[disease]['percentage'] = (disease_stats[disease]['count'] / total_predictions * 100) if total_predictions > 0 else 0
-        disease_stats[disease]['avg_confidence'] = disease_stats[disease]['confidence_sum'] / disease_stats[disease]['count']
+    # Counts, percentages and average confidence per disease, grouped in SQL
+    disease_stats = cached_fragment('disease_stats', lambda: disease_statistics(total_predictions))
     
-    # Sort by frequency and get top 5
-    top_diseases = sorted(disease_stats.items(), key=lambda x: x[1]['count'], reverse=True)[:5]
+    # Already sorted by frequency, keep the top 5
+    top_diseases = list(disease_stats.items())[:5]
     
     # Get recent predictions (last 10)
-    recent_predictions = diseaseinfo.objects.all().order_by('-id')[:10]
-    
-    # Get prediction method stats
-    symptoms_predictions = diseaseinfo.objects.filter(prediction_method='symptoms').count()
-    image_predictions = diseaseinfo.objects.filter(prediction_method='image').count()
+    recent = cached_fragment('recent_predictions', recent_predictions)
     
-    # Get monthly statistics (last 6 months)
-    from datetime import datetime, timedelta
-    monthly_stats = []
-    for i in range(6):
-        month_date = datetime.now() - timedelta(days=30*i)
-        month_name = month_date.strftime('%B %Y')
-        month_predictions = diseaseinfo.objects.filter(
-            id__gte=month_date.replace(day=1).timestamp()
-        ).count()
-        monthly_stats.append({'month': month_name, 'count': month_predictions})
+    # Predictions per week/month/year from one TruncMonth-style group-by
+    stats_range = request.GET.get('range', 'months')
+    if stats_range not in TIME_RANGES:
+        stats_range = 'months'
+    try:
+        stats_periods = min(max(int(request.GET.get('periods', 6)), 1), 60)
+    except ValueError:
+        stats_periods = 6
     
-    monthly_stats.reverse()
+    # Buckets move with the calendar, so the day is part of the key
+    time_series = cached_fragment(
+        f'time_series:{stats_range}:{stats_periods}:{timezone.localdate()}',
+        lambda: prediction_time_series(stats_range, stats_periods),
+    )
+    monthly_stats = [
+        {'month': bucket['label'], 'count': bucket['count']}
+        for bucket in time_series
+    ]
     
     context = {
         'total_predictions': total_predictions,
         'top_diseases': top_diseases,
-        'recent_predictions': recent_predictions,
+        'recent_predictions': recent,
         'symptoms_predictions': symptoms_predictions,
         'image_predictions': image_predictions,
         'monthly_stats': monthly_stats,
+        'stats_range': stats_range,
+        'stats_periods': stats_periods,
+        'range_choices': [('weeks', 'Weekly'), ('months', 'Monthly'), ('years', 'Yearly')],
         'disease_stats': disease_stats,
     }
     
@@ -315,8 +189,8 @@ def patient_ui(request):
 
       if request.user.is_authenticated:
 
-        patientusername = request.session['patientusername']
-        puser = User.objects.get(username=patientusername)
+        # The logged-in user, already loaded with its profile by ProfileMiddleware
+        puser = session_user(request, 'patientusername')
         patient_obj = puser.patient
 
         # Get statistics for the patient
@@ -368,34 +242,7 @@ def checkdisease(request):
   'Arthritis', '(vertigo) Paroymsal  Positional Vertigo','Acne', 'Urinary tract infection', 'Psoriasis', 'Impetigo']
 
 
-  symptomslist=['itching','skin_rash','nodal_skin_eruptions','continuous_sneezing','shivering','chills','joint_pain',
-  'stomach_pain','acidity','ulcers_on_tongue','muscle_wasting','vomiting','burning_micturition','spotting_ urination',
-  'fatigue','weight_gain','anxiety','cold_hands_and_feets','mood_swings','weight_loss','restlessness','lethargy',
-  'patches_in_throat','irregular_sugar_level','cough','high_fever','sunken_eyes','breathlessness','sweating',
-  'dehydration','indigestion','headache','yellowish_skin','dark_urine','nausea','loss_of_appetite','pain_behind_the_eyes',
-  'back_pain','constipation','abdominal_pain','diarrhoea','mild_fever','yellow_urine',
-  'yellowing_of_eyes','acute_liver_failure','fluid_overload','swelling_of_stomach',
-  'swelled_lymph_nodes','malaise','blurred_and_distorted_vision','phlegm','throat_irritation',
-  'redness_of_eyes','sinus_pressure','runny_nose','congestion','chest_pain','weakness_in_limbs',
-  'fast_heart_rate','pain_during_bowel_movements','pain_in_anal_region','bloody_stool',
-  'irritation_in_anus','neck_pain','dizziness','cramps','bruising','obesity','swollen_legs',
-  'swollen_blood_vessels','puffy_face_and_eyes','enlarged_thyroid','brittle_nails',
-  'swollen_extremeties','excessive_hunger','extra_marital_contacts','drying_and_tingling_lips',
-  'slurred_speech','knee_pain','hip_joint_pain','muscle_weakness','stiff_neck','swelling_joints',
-  'movement_stiffness','spinning_movements','loss_of_balance','unsteadiness',
-  'weakness_of_one_body_side','loss_of_smell','bladder_discomfort','foul_smell_of urine',
-  'continuous_feel_of_urine','passage_of_gases','internal_itching','toxic_look_(typhos)',
-  'depression','irritability','muscle_pain','altered_sensorium','red_spots_over_body','belly_pain',
-  'abnormal_menstruation','dischromic _patches','watering_from_eyes','increased_appetite','polyuria','family_history','mucoid_sputum',
-  'rusty_sputum','lack_of_concentration','visual_disturbances','receiving_blood_transfusion',
-  'receiving_unsterile_injections','coma','stomach_bleeding','distention_of_abdomen',
-  'history_of_alcohol_consumption','fluid_overload','blood_in_sputum','prominent_veins_on_calf',
-  'palpitations','painful_walking','pus_filled_pimples','blackheads','scurring','skin_peeling',
-  'silver_like_dusting','small_dents_in_nails','inflammatory_nails','blister','red_sore_around_nose',
-  'yellow_crust_ooze']
-
-  alphabaticsymptomslist = sorted(symptomslist)
-
+  alphabaticsymptomslist = sorted(SYMPTOMS)
   
 
 
@@ -428,102 +275,36 @@ def checkdisease(request):
       
 
       
-        testingsymptoms = []
-        #append zero in all coloumn fields...
-        for x in range(0, len(symptomslist)):
-          testingsymptoms.append(0)
+        inputtest, unknownsymptoms = encode_symptoms(psymptoms)
+        if unknownsymptoms:
+          print("unknown symptoms ignored : {0}".format(unknownsymptoms))
+        if not inputtest.any():
+          return JsonResponse({'error': NO_KNOWN_SYMPTOMS, 'predicteddisease': "none", 'confidencescore': 0,
+                               'unknownsymptoms': unknownsymptoms}, status=400)
 
 
-        #update 1 where symptoms gets matched...
-        for k in range(0, len(symptomslist)):
-
-          for z in psymptoms:
-              if (z == symptomslist[k]):
-                  testingsymptoms[k] = 1
-
-
-        inputtest = [testingsymptoms]
-
-        print(inputtest)
-      
+        topk = request.POST.get("topk", DIFFERENTIAL_SIZE)
+        try:
+          topk = int(topk)
+        except (TypeError, ValueError):
+          topk = DIFFERENTIAL_SIZE
 
-        predicted = model.predict(inputtest)
+        differential = predict_top_k(get_symptom_model(), inputtest, topk)
         print("predicted disease is : ")
-        print(predicted)
+        print(differential[0]['disease'])
+        print(" confidence score of : = {0} ".format(differential[0]['confidence']))
 
-        y_pred_2 = model.predict_proba(inputtest)
-        confidencescore=y_pred_2.max() * 100
-        print(" confidence score of : = {0} ".format(confidencescore))
+        confidencescore = format(differential[0]['confidence'], '.0f')
+        predicted_disease = differential[0]['disease']
+        consultdoctor = differential[0]['consultdoctor']
 
-        confidencescore = format(confidencescore, '.0f')
-        predicted_disease = predicted[0]
-
-        
-
-        #consult_doctor codes----------
-
-        #   doctor_specialization = ["Rheumatologist","Cardiologist","ENT specialist","Orthopedist","Neurologist",
-        #                             "Allergist/Immunologist","Urologist","Dermatologist","Gastroenterologist"]
-        
-
-        Rheumatologist = [  'Osteoarthristis','Arthritis']
-       
-        Cardiologist = [ 'Heart attack','Bronchial Asthma','Hypertension ']
-       
-        ENT_specialist = ['(vertigo) Paroymsal  Positional Vertigo','Hypothyroidism' ]
-
-        Orthopedist = []
-
-        Neurologist = ['Varicose veins','Paralysis (brain hemorrhage)','Migraine','Cervical spondylosis']
-
-        Allergist_Immunologist = ['Allergy','Pneumonia',
-        'AIDS','Common Cold','Tuberculosis','Malaria','Dengue','Typhoid']
-
-        Urologist = [ 'Urinary tract infection',
-         'Dimorphic hemmorhoids(piles)']
-
-        Dermatologist = [  'Acne','Chicken pox','Fungal infection','Psoriasis','Impetigo']
-
-        Gastroenterologist = ['Peptic ulcer diseae', 'GERD','Chronic cholestasis','Drug Reaction','Gastroenteritis','Hepatitis E',
-        'Alcoholic hepatitis','Jaundice','hepatitis A',
-         'Hepatitis B', 'Hepatitis C', 'Hepatitis D','Diabetes ','Hypoglycemia']
-         
-        if predicted_disease in Rheumatologist :
-           consultdoctor = "Rheumatologist"
-           
-        if predicted_disease in Cardiologist :
-           consultdoctor = "Cardiologist"
-           
-
-        elif predicted_disease in ENT_specialist :
-           consultdoctor = "ENT specialist"
-     
-        elif predicted_disease in Orthopedist :
-           consultdoctor = "Orthopedist"
-     
-        elif predicted_disease in Neurologist :
-           consultdoctor = "Neurologist"
-     
-        elif predicted_disease in Allergist_Immunologist :
-           consultdoctor = "Allergist/Immunologist"
-     
-        elif predicted_disease in Urologist :
-           consultdoctor = "Urologist"
-     
-        elif predicted_disease in Dermatologist :
-           consultdoctor = "Dermatologist"
-     
-        elif predicted_disease in Gastroenterologist :
-           consultdoctor = "Gastroenterologist"
-     
-        else :
-           consultdoctor = "other"
+        for d in differential:
+          d['confidence'] = format(d['confidence'], '.0f')
 
 
         request.session['doctortype'] = consultdoctor 
 
-        patientusername = request.session['patientusername']
-        puser = User.objects.get(username=patientusername)
+        puser = session_user(request, 'patientusername')
      
 
         #saving to database.....................
@@ -542,7 +323,7 @@ def checkdisease(request):
 
         print("disease record saved sucessfully.............................")
 
-        return JsonResponse({'predicteddisease': predicted_disease ,'confidencescore':confidencescore , "consultdoctor": consultdoctor})
+        return JsonResponse({'predicteddisease': predicted_disease ,'confidencescore':confidencescore , "consultdoctor": consultdoctor, "unknownsymptoms": unknownsymptoms, "differential": differential})
    
 
 
@@ -557,9 +338,105 @@ def checkdisease(request):
 
 
 
+def _is_symptom_list(symptoms):
+    return isinstance(symptoms, list) and all(isinstance(s, str) for s in symptoms)
+
+
+def checkdisease_batch(request):
+    """
+    Predict several symptom sets in one request.
+    Expects a JSON body {"symptom_sets": [...]} where every item is either a
+    list of symptom names or {"symptoms": [...], "patientusername": "..."}.
+    Predictions are saved for the session's patient; only staff and doctors
+    may name another patient per item. Every item must resolve to an existing
+    patient, or nothing is predicted.
+    """
+    if request.method != 'POST':
+        return HttpResponse('Request must be POST.', status=405)
+
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Please login first'}, status=400)
+
+    try:
+        items = json.loads(request.body)['symptom_sets']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Expected a JSON body with a "symptom_sets" list'}, status=400)
+
+    if not isinstance(items, list) or not items:
+        return JsonResponse({'error': '"symptom_sets" must be a non-empty list'}, status=400)
+    if len(items) > SYMPTOM_BATCH_MAX_SIZE:
+        return JsonResponse({'error': f'At most {SYMPTOM_BATCH_MAX_SIZE} symptom sets per request'}, status=400)
+
+    default_username = request.session.get('patientusername')
+    may_assign = request.user.is_staff or hasattr(request.user, 'doctor')
+    symptom_sets = []
+    usernames = []
+    for index, item in enumerate(items):
+        symptoms = item.get('symptoms') if isinstance(item, dict) else item
+        username = item.get('patientusername', default_username) if isinstance(item, dict) else default_username
+        if not _is_symptom_list(symptoms) or not (username is None or isinstance(username, str)):
+            return JsonResponse(
+                {'error': f'symptom_sets[{index}] must be a list of symptom names or {{"symptoms": [...]}}'},
+                status=400,
+            )
+        symptom_sets.append(symptoms)
+        usernames.append(username if may_assign else default_username)
+
+    patients = {
+        p.user.username: p
+        for p in patient.objects.select_related('user').filter(user__username__in=set(usernames))
+    }
+    for index, username in enumerate(usernames):
+        if username is None:
+            return JsonResponse({'error': f'symptom_sets[{index}] names no patient'}, status=400)
+        if username not in patients:
+            return JsonResponse({'error': f'symptom_sets[{index}]: unknown patient "{username}"'}, status=400)
+
+    inputtest, unknownsymptoms = encode_symptom_sets(symptom_sets)
+    labels, confidences = predict_batch(get_symptom_model(), inputtest)
+
+    results = []
+    new_rows = []
+    for i, symptoms in enumerate(symptom_sets):
+        if not inputtest[i].any():
+            results.append({'error': NO_KNOWN_SYMPTOMS, 'predicteddisease': "none", 'confidencescore': 0,
+                            'unknownsymptoms': unknownsymptoms[i]})
+            continue
+
+        predicted_disease = str(labels[i])
+        confidencescore = format(confidences[i], '.0f')
+        consultdoctor = consult_doctor_for(predicted_disease)
+
+        new_rows.append((len(results), diseaseinfo(
+            patient=patients.get(usernames[i]),
+            diseasename=predicted_disease,
+            no_of_symp=len(symptoms),
+            symptomsname=symptoms,
+            confidence=confidencescore,
+            consultdoctor=consultdoctor
+        )))
+        results.append({
+            'predicteddisease': predicted_disease,
+            'confidencescore': confidencescore,
+            'consultdoctor': consultdoctor,
+            'unknownsymptoms': unknownsymptoms[i],
+        })
+
+    with transaction.atomic():
+        saved = diseaseinfo.objects.bulk_create([row for _, row in new_rows])
+        # bulk_create sends no post_save, so fold the batch into the rollup here
+        record_predictions(saved)
+    for (position, _), row in zip(new_rows, saved):
+        results[position]['diseaseinfo_id'] = row.id
+
+    return JsonResponse({'results': results})
+
+
 def scan_image(request):
     """
     Image-based skin disease prediction view
+    POST with async=1 queues the prediction and answers 202 with a job id
+    that scan_image_status reports on.
     """
     if request.method == 'GET':
         # Check if user is authenticated
@@ -570,7 +447,7 @@ def scan_image(request):
             # Try to get patient from session first
             patientusername = request.session.get('patientusername')
             if patientusername:
-                puser = User.objects.get(username=patientusername)
+                puser = session_user(request, 'patientusername')
             else:
                 # If not in session, try to get from authenticated user
                 puser = request.user
@@ -600,7 +477,7 @@ def scan_image(request):
             # Try to get patient from session first
             patientusername = request.session.get('patientusername')
             if patientusername:
-                puser = User.objects.get(username=patientusername)
+                puser = session_user(request, 'patientusername')
             else:
                 # If not in session, use authenticated user
                 puser = request.user
@@ -619,79 +496,31 @@ def scan_image(request):
             
             uploaded_image = request.FILES['skin_image']
             
-            # Validate image
-            try:
-                img = Image.open(uploaded_image)
-                img.verify()  # Verify it's a valid image
-            except Exception as e:
-                return JsonResponse({'error': 'Invalid image file'}, status=400)
-            
-            # Reset image pointer after verify
-            uploaded_image.seek(0)
-            img = Image.open(uploaded_image)
+            if request.POST.get('async') == '1':
+                try:
+                    job = submit_scan_job(patient_obj, uploaded_image)
+                except ImageIngestError as e:
+                    return JsonResponse({'error': str(e)}, status=400)
+                return JsonResponse({
+                    'job_id': str(job.id),
+                    'status': job.status,
+                    'status_url': reverse('scan_image_status', args=[job.id])
+                }, status=202)
             
-            # Validate that this is a skin disease image
-            skin_validation = validate_skin_image(img)
-            if not skin_validation['is_skin_image']:
+            try:
+                result = classify_skin_image(uploaded_image, max_pixels=MAX_UPLOAD_PIXELS, timeout=IMAGE_PREDICT_TIMEOUT)
+            except SkinImageRejected as e:
                 return JsonResponse({
                     'error': 'Invalid Image',
-                    'message': 'Please upload a clear image of skin disease/lesion. ' + skin_validation['reason']
+                    'message': 'Please upload a clear image of skin disease/lesion. ' + e.reason
                 }, status=400)
+            except ImageIngestError as e:
+                return JsonResponse({'error': str(e)}, status=400)
+            uploaded_image.seek(0)
             
-            img = img.convert('RGB')
-            img = img.resize((224, 224))
-            
-            img_array = np.array(img)
-            img_batch = img_array / 255.0
-            img_batch = np.expand_dims(img_batch, axis=0)
-            
-            # Run CNN model if available, else fallback to basic image analysis
-            if image_model and image_labels:
-                preds = image_model.predict(img_batch)
-                idx = int(np.argmax(preds))
-                predicted_disease = image_labels[idx] if idx < len(image_labels) else "Skin Condition"
-                confidence = float(np.max(preds)) * 100
-            else:
-                try:
-                    img_array_flat = img_array.flatten()
-                    
-                    avg_color = np.mean(img_array, axis=(0, 1)) / 255.0
-                    red_ratio = float(avg_color[0]) / float(avg_color[1] + avg_color[2] + 1e-6)
-                    blue_ratio = float(avg_color[2]) / float(avg_color[0] + avg_color[1] + 1e-6)
-                    
-                    brightness = np.mean(img_array)
-                    
-                    if red_ratio > 1.5:
-                        if brightness < 100:
-                            predicted_disease = "Skin Lesion - Possible Infection"
-                            confidence = 75.2
-                        else:
-                            predicted_disease = "Erythema (Red Skin)"
-                            confidence = 68.4
-                    elif blue_ratio > 1.2:
-                        predicted_disease = "Cyanosis or Blue Discoloration"
-                        confidence = 71.8
-                    elif brightness < 80:
-                        predicted_disease = "Melanocytic Lesion"
-                        confidence = 72.6
-                    elif brightness > 180:
-                        predicted_disease = "Hypopigmented Lesion"
-                        confidence = 69.1
-                    else:
-                        if np.std(img_array) > 30:
-                            predicted_disease = "Multicolored Skin Condition"
-                            confidence = 74.3
-                        else:
-                            predicted_disease = "Benign Skin Condition"
-                            confidence = 67.8
-                            
-                except Exception as e:
-                    print(f"Error in basic image analysis: {str(e)}")
-                    predicted_disease = "Skin Condition - Requires Expert Review"
-                    confidence = 65.0
-            
-            # Map to doctor specialization (similar to symptom-based prediction)
-            consultdoctor = "Dermatologist"
+            predicted_disease = result['predicteddisease']
+            confidence = result['confidence']
+            consultdoctor = result['consultdoctor']
             
             # Set doctortype in session for consult_a_doctor view
             request.session['doctortype'] = consultdoctor
@@ -704,7 +533,7 @@ def scan_image(request):
                 symptomsname=json.dumps([]),  # Empty symptoms list
                 confidence=confidence,
                 consultdoctor=consultdoctor,
-                skin_image=uploaded_image,
+                skin_image=uploaded_image,  # the original upload, not the decoded copy
                 prediction_method='image'
             )
             diseaseinfo_new.save()
@@ -726,68 +555,111 @@ def scan_image(request):
     return HttpResponse('Method not allowed', status=405)
 
 
+def scan_image_status(request, job_id):
+    """
+    Poll an asynchronous image prediction job started with scan_image async=1
+    """
+    if request.method != 'GET':
+        return HttpResponse('Method not allowed', status=405)
+
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Please login first'}, status=400)
+
+    try:
+        job = image_scan_job.objects.select_related('diseaseinfo').get(pk=job_id, patient__user=request.user)
+    except image_scan_job.DoesNotExist:
+        return JsonResponse({'error': 'Job not found'}, status=404)
+
+    if job.status == 'failed':
+        return JsonResponse({'job_id': str(job.id), 'status': job.status, 'error': job.error})
+
+    if job.status != 'done' or job.diseaseinfo is None:
+        return JsonResponse({'job_id': str(job.id), 'status': job.status})
+
+    result = job.diseaseinfo
+
+    # Same session state the synchronous scan sets for consult_a_doctor
+    request.session['doctortype'] = result.consultdoctor
+    request.session['diseaseinfo_id'] = result.id
+
+    return JsonResponse({
+        'job_id': str(job.id),
+        'status': job.status,
+        'predicteddisease': result.diseasename,
+        'confidencescore': str(result.confidence),
+        'consultdoctor': result.consultdoctor,
+        'image_url': result.skin_image.url if result.skin_image else None
+    })
+
+
+def _id_page(queryset, before, limit):
+    """
+    One page of `queryset`, newest id first, keyset-paginated on id so a page
+    costs the same however far back it is. `before` is the older_cursor of
+    the previous page; a missing or malformed one gives the newest page.
+    Returns: (rows, older_cursor), older_cursor None on the last page.
+    """
+    try:
+        queryset = queryset.filter(id__lt=int(before))
+    except (TypeError, ValueError):
+        pass
+    rows = list(queryset.order_by('-id')[:limit + 1])
+    if len(rows) > limit:
+        return rows[:limit], rows[limit - 1].id
+    return rows, None
+
+
 def pconsultation_history(request):
 
     if request.method == 'GET':
 
-      patientusername = request.session['patientusername']
-      puser = User.objects.get(username=patientusername)
+      puser = session_user(request, 'patientusername')
       patient_obj = puser.patient
-        
-      consultationnew = consultation.objects.filter(patient = patient_obj)
-      
-    
-      return render(request,'patient/consultation_history/consultation_history.html',{"consultation":consultationnew})
+
+      # Everything the template shows, joined into one query per page
+      consultationnew = (
+          consultation.objects.filter(patient = patient_obj)
+          .select_related('doctor__user', 'diseaseinfo')
+          .only('id', 'consultation_date', 'status', 'doctor__name', 'doctor__user__email',
+                'doctor__user__username', 'diseaseinfo__diseasename')
+      )
+      page, older_cursor = _id_page(consultationnew, request.GET.get('before'), CONSULTATION_PAGE_SIZE)
+
+      return render(request,'patient/consultation_history/consultation_history.html',
+                    {"consultation":page, "older_cursor":older_cursor, "before":request.GET.get('before')})
 
 
 def dconsultation_history(request):
 
     if request.method == 'GET':
 
-      doctorusername = request.session['doctorusername']
-      duser = User.objects.get(username=doctorusername)
+      duser = session_user(request, 'doctorusername')
       doctor_obj = duser.doctor
-        
-      consultationnew = consultation.objects.filter(doctor = doctor_obj)
-      
-    
-      return render(request,'doctor/consultation_history/consultation_history.html',{"consultation":consultationnew})
+
+      consultationnew = (
+          consultation.objects.filter(doctor = doctor_obj)
+          .select_related('patient__user', 'diseaseinfo')
+          .only('id', 'consultation_date', 'status', 'patient__name', 'patient__user__email',
+                'patient__user__username', 'diseaseinfo__diseasename')
+      )
+      page, older_cursor = _id_page(consultationnew, request.GET.get('before'), CONSULTATION_PAGE_SIZE)
+
+      return render(request,'doctor/consultation_history/consultation_history.html',
+                    {"consultation":page, "older_cursor":older_cursor, "before":request.GET.get('before')})
 
 
 def doctor_ui(request):
 
     if request.method == 'GET':
 
-      doctorid = request.session['doctorusername']
-      duser = User.objects.get(username=doctorid)
+      duser = session_user(request, 'doctorusername')
       doctor_obj = duser.doctor
 
-      # Get statistics for the doctor
-      total_consultations = consultation.objects.filter(doctor=doctor_obj).count()
-      active_consultations = consultation.objects.filter(doctor=doctor_obj, status="active").count()
-      completed_consultations = consultation.objects.filter(doctor=doctor_obj, status="closed").count()
-      
-      # Get doctor's rating and review stats
-      reviews = rating_review.objects.filter(doctor=doctor_obj)
-      total_reviews = reviews.count()
-      avg_rating = reviews.aggregate(models.Avg('rating'))['rating__avg'] or 0
-      doctor_rating = round(avg_rating, 1)
-
-      # Calculate performance score based on consultations and rating
-      performance_score = min(5, max(1, (total_consultations // 5) + int(doctor_rating)))
-      if total_consultations == 0:
-          performance_score = 3  # Default score for new doctors
-
+      # Consultation counters from one cached conditional aggregate, ratings
+      # from the doctor's running totals
+      stats = doctor_stats(doctor_obj)
     
-      return render(request,'doctor/doctor_ui/profile.html',{
-          "duser": duser,
-          "total_consultations": total_consultations,
-          "active_consultations": active_consultations,
-          "completed_consultations": completed_consultations,
-          "total_reviews": total_reviews,
-          "doctor_rating": doctor_rating,
-          "performance_score": performance_score
-      })
+      return render(request,'doctor/doctor_ui/profile.html', dict(stats, duser=duser))
 
 
 
@@ -799,10 +671,16 @@ def dviewprofile(request, doctorusername):
     if request.method == 'GET':
 
          
-         duser = User.objects.get(username=doctorusername)
-         r = rating_review.objects.filter(doctor=duser.doctor)
-       
-         return render(request,'doctor/view_profile/view_profile.html', {"duser":duser, "rate":r} )
+         duser = User.objects.select_related('doctor').get(username=doctorusername)
+         r = (
+             rating_review.objects.filter(doctor=duser.doctor)
+             .select_related('patient')
+             .only('id', 'rating', 'review', 'patient__name')
+         )
+         page, older_cursor = _id_page(r, request.GET.get('before'), REVIEW_PAGE_SIZE)
+
+         return render(request,'doctor/view_profile/view_profile.html',
+                       {"duser":duser, "rate":page, "older_cursor":older_cursor, "before":request.GET.get('before')} )
 
 
 
@@ -821,8 +699,10 @@ def  consult_a_doctor(request):
         if not request.user.is_authenticated:
             return redirect('home')
         
-        # Only show Dermatologists (skin-related doctors)
-        dobj = doctor.objects.filter(specialization__iexact='Dermatologist')
+        # Only show Dermatologists (skin-related doctors). Compared on
+        # Lower(specialization) rather than with iexact so that the
+        # doctor_specialization_idx expression index can be used
+        dobj = doctor.objects.alias(specialization_lower=Lower('specialization')).filter(specialization_lower='dermatologist')
         
         # If no dermatologists found, return empty queryset
         if not dobj.exists():
@@ -846,7 +726,7 @@ def  make_consultation(request, doctorusername):
         try:
             patientusername = request.session.get('patientusername')
             if patientusername:
-                puser = User.objects.get(username=patientusername)
+                puser = session_user(request, 'patientusername')
             else:
                 # If not in session, use authenticated user
                 puser = request.user
@@ -942,17 +822,21 @@ def  consultationview(request,consultation_id):
 def rate_review(request,consultation_id):
    if request.method == "POST":
          
-         consultation_obj = consultation.objects.get(id=consultation_id)
+         consultation_obj = consultation.objects.select_related('patient', 'doctor').get(id=consultation_id)
          patient = consultation_obj.patient
          doctor1 = consultation_obj.doctor
-         rating = request.POST.get('rating')
-         review = request.POST.get('review')
-
-         rating_obj = rating_review(patient=patient,doctor=doctor1,rating=rating,review=review)
-         rating_obj.save()
-
-         rate = int(rating_obj.rating_is)
-         doctor.objects.filter(pk=doctor1).update(rating=rate)
+         try:
+             rating = int(request.POST.get('rating'))
+         except (TypeError, ValueError):
+             messages.error(request, 'Please select a rating.')
+             return redirect('consultationview',consultation_id)
+         if not RATING_MIN <= rating <= RATING_MAX:
+             messages.error(request, f'Please select a rating from {RATING_MIN} to {RATING_MAX}.')
+             return redirect('consultationview',consultation_id)
+         review = request.POST.get('review', '')
+
+         # Stores the review and updates the doctor's rating totals atomically
+         submit_rating(patient, doctor1, rating, review)
          
 
          return redirect('consultationview',consultation_id)
@@ -965,6 +849,9 @@ def close_consultation(request,consultation_id):
    if request.method == "POST":
          
          consultation.objects.filter(pk=consultation_id).update(status="closed")
+         # update() sends no post_save, so drop the doctor's cached counters here
+         doctor_id = consultation.objects.filter(pk=consultation_id).values_list('doctor_id', flat=True).first()
+         invalidate_doctor_stats(doctor_id)
          
          return redirect('home')
 
@@ -973,6 +860,179 @@ def close_consultation(request,consultation_id):
 
 
 
+def _sse_event(event):
+    return f"id: {event['id']}\nevent: message\ndata: {json.dumps(event)}\n\n"
+
+
+def _chat_events_after(consultation_id, last_id):
+    """Returns: chat events of the consultation's messages after `last_id`, oldest first."""
+    rows = (
+        Chat.objects
+        .filter(consultation_id=consultation_id, id__gt=last_id)
+        .select_related('sender')
+        .order_by('id')
+    )
+    return [chat_event(row) for row in rows]
+
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def _chat_cursor(chat):
+    micros = (chat.created - _EPOCH) // datetime.timedelta(microseconds=1)
+    return f'{micros}-{chat.id}'
+
+
+def _parse_chat_cursor(cursor):
+    # Raises ValueError, or OverflowError for a date out of range
+    micros, chat_id = cursor.split('-')
+    chat_id = int(chat_id)
+    if not 0 < chat_id < 2 ** 63:
+        raise ValueError('chat id out of range')
+    return _EPOCH + datetime.timedelta(microseconds=int(micros)), chat_id
+
+
+def _chat_page(consultation_id, before=None, limit=CHAT_PAGE_SIZE):
+    """
+    One page of a consultation's messages, keyset-paginated by (created, id)
+    so a page costs the same however deep into the history it is.
+    `before` is the (created, id) of the oldest message already shown.
+    Returns: (messages oldest first, cursor of the next older page or None)
+    """
+    rows = Chat.objects.filter(consultation_id=consultation_id)
+    if before is not None:
+        created, chat_id = before
+        rows = rows.filter(models.Q(created__lt=created) | models.Q(created=created, id__lt=chat_id))
+    rows = list(rows.select_related('sender').order_by('-created', '-id')[:limit + 1])
+
+    has_older = len(rows) > limit
+    page = rows[:limit][::-1]
+    return page, (_chat_cursor(page[0]) if has_older else None)
+
+
+def chat_history(request):
+    """
+    Older chat messages of the session's consultation, as JSON.
+    GET ?before=<cursor> returns the page preceding that cursor; cursors come
+    from the load-older marker of chat_messages and from `older_cursor` here.
+    """
+    consultation_id = request.session.get('consultation_id')
+    if not consultation_id:
+        return JsonResponse({'error': 'No consultation session found'}, status=400)
+
+    before = request.GET.get('before')
+    if before:
+        try:
+            before = _parse_chat_cursor(before)
+        except (ValueError, OverflowError):
+            return JsonResponse({'error': 'Invalid before cursor'}, status=400)
+
+    messages, older_cursor = _chat_page(consultation_id, before or None)
+    return JsonResponse({'messages': [chat_event(m) for m in messages], 'older_cursor': older_cursor})
+
+
+def _chat_stream(consultation_id, last_id):
+    deadline = time.monotonic() + CHAT_STREAM_TIMEOUT
+    recheck = not get_backend().cross_process
+
+    with subscribe_consultation(consultation_id) as subscription:
+        yield 'retry: 3000\n\n'
+        # Catch up on messages posted between the page load and the
+        # subscription; the version is read first, so a post committed
+        # during the query still changes it
+        version = chat_version(consultation_id)
+        events = _chat_events_after(consultation_id, last_id)
+        while True:
+            for event in events:
+                if event['id'] > last_id:
+                    last_id = event['id']
+                    yield _sse_event(event)
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            events = subscription.get(timeout=min(remaining, CHAT_STREAM_RECHECK) if recheck else remaining)
+            if not events:
+                # Heartbeat, so streams of closed tabs are noticed and released
+                yield ': keepalive\n\n'
+                if recheck:
+                    # Only query when a post went through another process
+                    latest = chat_version(consultation_id)
+                    if latest is None or latest != version:
+                        version = latest
+                        events = _chat_events_after(consultation_id, last_id)
+
+
+_open_streams = 0
+_open_streams_lock = threading.Lock()
+
+
+def _max_chat_streams():
+    if CHAT_STREAM_MAX_PER_WORKER is not None:
+        return CHAT_STREAM_MAX_PER_WORKER
+    threads = worker_threads()
+    return None if threads is None else threads // 2
+
+
+def _take_stream_slot():
+    global _open_streams
+    limit = _max_chat_streams()
+    with _open_streams_lock:
+        if limit is not None and _open_streams >= limit:
+            return False
+        _open_streams += 1
+        return True
+
+
+class _ChatStreamBody:
+    """Stream body that gives its slot back when the server closes the response."""
+
+    def __init__(self, events):
+        self._events = events
+        self._closed = False
+
+    def __iter__(self):
+        return self._events
+
+    def close(self):
+        global _open_streams
+        self._events.close()
+        with _open_streams_lock:
+            if not self._closed:
+                self._closed = True
+                _open_streams -= 1
+
+
+def chat_stream(request):
+    """
+    Server-sent event stream of the messages posted to the session's
+    consultation after `last_id` (or the Last-Event-ID header on reconnect).
+    The stream ends after CHAT_STREAM_TIMEOUT seconds and the browser's
+    EventSource reconnects from the last id it received. A worker already
+    holding CHAT_STREAM_MAX_PER_WORKER streams answers 503 and the page
+    polls instead.
+    """
+    consultation_id = request.session.get('consultation_id')
+    if not consultation_id:
+        return JsonResponse({'error': 'No consultation session found'}, status=400)
+
+    try:
+        last_id = int(request.META.get('HTTP_LAST_EVENT_ID') or request.GET.get('last_id', 0))
+    except ValueError:
+        return JsonResponse({'error': 'last_id must be a message id'}, status=400)
+
+    if not _take_stream_slot():
+        response = JsonResponse({'error': 'Too many open chat streams, poll chat_messages instead'}, status=503)
+        response['Retry-After'] = str(CHAT_STREAM_TIMEOUT)
+        return response
+
+    body = _ChatStreamBody(_chat_stream(consultation_id, last_id))
+    response = StreamingHttpResponse(body, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # stop nginx from buffering the stream
+    return response
+
+
 #-----------------------------chatting system ---------------------------------------------------
 
 
@@ -988,12 +1048,22 @@ def post(request):
             if not consultation_id:
                 return JsonResponse({'error': 'No consultation session found'}, status=400)
             
-            consultation_obj = consultation.objects.get(id=consultation_id)
-            c = Chat(consultation_id=consultation_obj, sender=request.user, message=msg)
+            if not consultation.objects.filter(id=consultation_id).exists():
+                raise consultation.DoesNotExist
+
+            if CHAT_ASYNC_WRITES:
+                # Stored by the outbox flusher, which then publishes it
+                key = chat_outbox.enqueue(consultation_id, request.user.id, msg)
+                return JsonResponse({ 'key': key, 'msg': msg, 'sender': request.user.username, 'success': True })
+
+            c = Chat(consultation_id_id=consultation_id, sender=request.user, message=msg)
             c.save()
+            # Update the chat ETag state and push the message to the open
+            # chat streams once it is committed
+            transaction.on_commit(lambda: chat_posted(c))
             
             print(f"Message saved: {msg} by {request.user.username}")
-            return JsonResponse({ 'msg': msg, 'sender': request.user.username, 'success': True })
+            return JsonResponse({ 'id': c.id, 'msg': msg, 'sender': request.user.username, 'success': True })
         except consultation.DoesNotExist:
             return JsonResponse({'error': 'Consultation not found'}, status=404)
         except Exception as e:
@@ -1004,15 +1074,44 @@ def post(request):
 
 
 
+def _chat_messages_etag(request):
+    # Changes whenever a message is posted; the user is part of it because
+    # chat_body.html renders messages as sent or received
+    consultation_id = request.session.get('consultation_id')
+    if not consultation_id:
+        return None
+    last_id, count = chat_state(consultation_id)
+    return f'{consultation_id}-{last_id}-{count}-{request.user.pk}'
+
+
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_chat_messages_etag)
 def chat_messages(request):
    if request.method == "GET":
+         consultation_id = request.session.get('consultation_id')
+
+         # ?since=<message id> returns only the newer messages, as JSON
+         since = request.GET.get('since')
+         if since is not None:
+             if not consultation_id:
+                 return JsonResponse({'error': 'No consultation session found'}, status=400)
+             try:
+                 since = int(since)
+             except ValueError:
+                 return JsonResponse({'error': 'since must be a message id'}, status=400)
+
+             if chat_state(consultation_id)[0] <= since:
+                 return JsonResponse({'messages': [], 'last_id': since})
+             messages = _chat_events_after(consultation_id, since)
+             return JsonResponse({'messages': messages, 'last_id': messages[-1]['id'] if messages else since})
+
          try:
-             consultation_id = request.session.get('consultation_id')
              if not consultation_id:
                  return HttpResponse('<div class="error-message">No consultation session found. Please start a consultation first.</div>')
              
-             c = Chat.objects.filter(consultation_id=consultation_id).order_by('created')
-             return render(request, 'consultation/chat_body.html', {'chat': c})
+             # Only the latest page; older ones are fetched from chat_history
+             c, older_cursor = _chat_page(consultation_id)
+             return render(request, 'consultation/chat_body.html', {'chat': c, 'older_cursor': older_cursor})
          except Exception as e:
              print(f"Error in chat_messages: {str(e)}")
              return HttpResponse('<div class="error-message">Error loading messages. Please refresh the page.</div>')